@@ -15,10 +15,27 @@ generator
   references to sprites that have been mapped.
 """
 
+from weakref import WeakValueDictionary
+
 class SpriteMap(list):
-    def __init__(self, fname, L=[]):
+    """A spritemap's list of sprites, which is kept free of duplicates: adding
+    a sprite that is already in it does nothing.
+    """
+
+    #: (fname, size) of a double resolution version of this spritemap, where
+    #: size is the size of this one
+    retina = None
+    #: (fname, mime type) of versions of this spritemap in other formats
+    alternatives = ()
+
+    def __init__(self, fname, L=[], origin=None):
         self.fname = fname
-        super(SpriteMap, self).__init__(L)
+        #: name of the spritemap the sprites were mapped to, which differs
+        #: from fname when it had to be split up
+        self.origin = fname if origin is None else origin
+        super(SpriteMap, self).__init__()
+        self._members = set()
+        self.extend(L)
 
     def __hash__(self):
         return hash(self.fname)
@@ -28,12 +45,48 @@ class SpriteMap(list):
             return o.fname == self.fname
         return NotImplemented
 
+    def __contains__(self, sref):
+        return sref in self._members
+
+    def append(self, sref):
+        if sref not in self._members:
+            self._members.add(sref)
+            super(SpriteMap, self).append(sref)
+
+    def extend(self, srefs):
+        for sref in srefs:
+            self.append(sref)
+
+    def __iadd__(self, srefs):
+        self.extend(srefs)
+        return self
+
 class SpriteRef(object):
-    """Reference to a sprite, existent or not."""
+    """Reference to a sprite, existent or not.
+
+    References are interned: as long as one is in use, making another with the
+    same file name and source gives the very same object.
+    """
+
+    __slots__ = ("fname", "source", "__weakref__")
+
+    _interned = WeakValueDictionary()
+
+    def __new__(cls, fname, source, *args):
+        key = (cls, fname, source)
+        self = cls._interned.get(key)
+        if self is None:
+            self = super(SpriteRef, cls).__new__(cls)
+            self.fname = fname
+            self.source = source
+            cls._interned[key] = self
+        return self
 
     def __init__(self, fname, source):
-        self.fname = fname
-        self.source = source
+        pass
+
+    def __reduce__(self):
+        return (type(self), (self.fname, self.source))
 
     def __str__(self):
         return self.fname
@@ -50,10 +103,24 @@ class SpriteRef(object):
         return NotImplemented
 
 class MappedSpriteRef(SpriteRef):
+    """A sprite reference with its position in a spritemap. These aren't
+    interned, as the position varies.
+    """
+
+    __slots__ = ("position",)
+
+    def __new__(cls, fname, source, pos):
+        self = object.__new__(cls)
+        self.fname = fname
+        self.source = source
+        return self
+
     def __init__(self, fname, source, pos):
-        super(MappedSpriteRef, self).__init__(fname, source)
         self.position = pos
 
+    def __reduce__(self):
+        return (type(self), (self.fname, self.source, self.position))
+
     def __repr__(self):
         args = (self.fname, self.source, self.position)
         return "MappedSpriteRef(%r, source=%r, pos=%r)" % args
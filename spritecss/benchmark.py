@@ -0,0 +1,247 @@
+"""Benchmarks for the slower steps of spritemapping
+
+Run as ``python -m spritecss.benchmark [name[=arg] ...]``; without names,
+every benchmark is run with its defaults. Timings are the best of a few runs.
+"""
+
+import os
+import sys
+import time
+import random
+from os import path
+from StringIO import StringIO
+
+#: name => benchmark function
+benchmarks = {}
+
+def benchmark(f):
+    benchmarks[f.__name__[len("bench_"):]] = f
+    return f
+
+def best_time(f, repeat=3):
+    best = None
+    for i in xrange(repeat):
+        t0 = time.time()
+        rv = f()
+        elapsed = time.time() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return (best, rv)
+
+def sample_rows(width, height, seed=0):
+    """Make RGBA rows that compress about as well as a spritemap: runs of
+    transparency and a limited number of colors.
+    """
+    rand = random.Random(seed)
+    colors = [bytearray(rand.randrange(256) for i in xrange(3)) + "\xff"
+              for i in xrange(32)]
+    colors.append(bytearray(4))
+    lines = []
+    for i in xrange(64):
+        line = bytearray()
+        while len(line) < width * 4:
+            line += rand.choice(colors) * rand.randrange(1, 24)
+        lines.append(line[:width * 4])
+    return [lines[(y * 7) % len(lines)] for y in xrange(height)]
+
+@benchmark
+def bench_png_write(arg="2048x2048", out=sys.stdout):
+    from .image import Image
+
+    (width, height) = map(int, arg.split("x"))
+    rows = sample_rows(width, height)
+    meta = {"bitdepth": 8, "alpha": True}
+    for threads in (1, 2, 4):
+        def run():
+            fo = StringIO()
+            Image(width, height, iter(rows), meta).save(fo, threads=threads)
+            return len(fo.getvalue())
+        (elapsed, size) = best_time(run)
+        print >>out, ("png_write %dx%d, %d threads: %.3fs, %d bytes" %
+                      (width, height, threads, elapsed, size))
+
+@benchmark
+def bench_png_read(arg=None, out=sys.stdout):
+    """Decode every PNG below directory *arg*, by default the sample site's
+    images, to RGBA through the fast and the generic row decoding paths.
+    """
+    from array import array
+    from itertools import imap, repeat
+    from . import png
+
+    class GenericReader(png.Reader):
+        """Reader taking the generic paths for every image: rows through
+        iterstraight and iterboxed, interlaced images deinterlaced whole.
+        """
+
+        def iterstraight_direct(self, raw):
+            return self.iterboxed(self.iterstraight(imap(array, repeat("B"),
+                                                         raw)))
+
+        def iterdeinterlace(self, raw):
+            flat = self.deinterlace(array("B", "".join(raw)))
+            vpr = self.width * self.planes
+            return (flat[i:i + vpr] for i in xrange(0, len(flat), vpr))
+
+    if arg is None:
+        arg = path.join(path.dirname(__file__), path.pardir, "htdocs")
+    datas = []
+    for (dirpath, dirnames, fnames) in os.walk(arg):
+        for fname in fnames:
+            if fname.endswith(".png"):
+                with open(path.join(dirpath, fname), "rb") as fp:
+                    datas.append(fp.read())
+
+    def as_rgba(cls):
+        def run():
+            for data in datas:
+                for row in cls(bytes=data).asRGBA()[2]:
+                    pass
+        return run
+
+    for (name, cls) in (("fast", png.Reader), ("generic", GenericReader)):
+        (elapsed, rv) = best_time(as_rgba(cls))
+        print >>out, ("png_read %d files, %s: %.3fs" %
+                      (len(datas), name, elapsed))
+
+@benchmark
+def bench_png_read_palette(arg="512x512", out=sys.stdout):
+    """Decode synthetic paletted images of size *arg*, as written by PNG
+    optimizers, against the same image as RGBA.
+    """
+    from . import png
+
+    (width, height) = map(int, arg.split("x"))
+    rand = random.Random(0)
+    palette = [(rand.randrange(256), rand.randrange(256),
+                rand.randrange(256), rand.randrange(256)) for i in xrange(16)]
+    indices = [[rand.randrange(16) for x in xrange(width)]
+               for y in xrange(height)]
+    images = []
+    for bitdepth in (4, 8):
+        fo = StringIO()
+        w = png.Writer(width, height, palette=palette, bitdepth=bitdepth)
+        w.write(fo, indices)
+        images.append(("%d-bit palette" % (bitdepth,), fo.getvalue()))
+    fo = StringIO()
+    w = png.Writer(width, height, alpha=True)
+    w.write(fo, ([c for i in row for c in palette[i]] for row in indices))
+    images.append(("RGBA", fo.getvalue()))
+
+    for (name, data) in images:
+        def run():
+            for row in png.Reader(bytes=data).asRGBA()[2]:
+                pass
+        (elapsed, rv) = best_time(run)
+        print >>out, ("png_read_palette %dx%d, %s: %.3fs" %
+                      (width, height, name, elapsed))
+
+def sample_css(n_rules=40, uri_size=6000, comment_size=80000, seed=0,
+               plain_rules=0):
+    """Make a stylesheet with a long header comment, rules with inline
+    base64 ``data:`` URIs and *plain_rules* rules without any URLs.
+    """
+    import base64
+
+    rand = random.Random(seed)
+    parts = ["/* %s */\n" % ("Licensed under the terms of the license. " *
+                              (comment_size // 41),)]
+    for i in xrange(n_rules):
+        data = "".join(chr(rand.randrange(256)) for k in xrange(uri_size))
+        parts.append(".icon-%d { background: url(data:image/png;base64,%s) "
+                     "no-repeat; width: 16px; }\n"
+                     % (i, base64.b64encode(data)))
+    for i in xrange(plain_rules):
+        parts.append(".rule-%d > a:hover {\n  color: #%06x;\n"
+                     "  margin: 0 %dpx;\n}\n"
+                     % (i, rand.randrange(2 ** 24), rand.randrange(20)))
+    return "".join(parts)
+
+@benchmark
+def bench_css_parse(arg="40", out=sys.stdout):
+    """Parse a stylesheet with *arg* rules holding data URIs."""
+    from .css import CSSParser
+
+    css = sample_css(n_rules=int(arg))
+    def run():
+        return sum(1 for ev in CSSParser.read_file(StringIO(css)))
+    (elapsed, n_events) = best_time(run)
+    print >>out, ("css_parse %d bytes, %d events: %.3fs" %
+                  (len(css), n_events, elapsed))
+
+@benchmark
+def bench_css_scan(arg="2000", out=sys.stdout):
+    """Find sprite references in a stylesheet with *arg* rules without any,
+    by full parsing and by scanning.
+    """
+    from .css import CSSParser, scan_css
+    from .finder import find_sprite_refs
+
+    css = sample_css(n_rules=10, plain_rules=int(arg))
+    for (name, parse) in (("parse", lambda: CSSParser(data=css)),
+                          ("scan", lambda: scan_css(css))):
+        def run():
+            return len(list(find_sprite_refs(parse(), root=".")))
+        (elapsed, n_refs) = best_time(run)
+        print >>out, ("css_scan %s %d bytes, %d refs: %.3fs" %
+                      (name, len(css), n_refs, elapsed))
+
+@benchmark
+def bench_css_resolve(arg="10000", out=sys.stdout):
+    """Map and replace *arg* background declarations spread over 50 sprite
+    directories, 20 of which are configured as sprite dirs.
+    """
+    from contextlib import contextmanager
+    from . import SpriteMap
+    from .config import CSSConfig
+    from .css import scan_css
+    from .finder import find_sprite_refs
+    from .main import CSSFile
+    from .replacer import SpriteReplacer
+
+    n_decls = int(arg)
+    css = "".join(".s%d { background: url(../img/d%d/s%d.png); }\n"
+                  % (i, i % 50, i) for i in xrange(n_decls))
+    sprite_dirs = " ".join("../img/d%d" % (i,) for i in xrange(0, 50, 5))
+    sprite_dirs += " " + " ".join("../img/d%d" % (i,) for i in xrange(1, 50, 5))
+
+    class MemoryCSSFile(CSSFile):
+        @contextmanager
+        def open_data(self):
+            yield css
+
+    fname = path.join("/site", "css", "main.css")
+    conf = CSSConfig(base={"sprite_dirs": sprite_dirs}, fname=fname)
+    css_f = MemoryCSSFile(fname, conf=conf)
+    evs = list(scan_css(css))
+
+    class Placed(object):
+        def __init__(self, sref):
+            self.fname = sref
+
+    def map_refs():
+        srefs = find_sprite_refs(evs, conf=conf, source=fname)
+        return css_f.mapper.map_reduced(srefs)
+    (map_elapsed, smaps) = best_time(map_refs)
+    sm_plcs = [(SpriteMap(sm.fname, sm),
+                [((i, 0), Placed(sref)) for (i, sref) in enumerate(sm)])
+               for sm in smaps.itervalues() if sm.fname]
+    replacer = SpriteReplacer(sm_plcs)
+    (replace_elapsed, edits) = best_time(lambda: list(replacer.iter_edits(css_f)))
+    print >>out, ("css_resolve %d declarations, %d spritemaps: "
+                  "map %.3fs, replace %.3fs, %d replaced" %
+                  (n_decls, len(sm_plcs), map_elapsed, replace_elapsed,
+                   len(edits)))
+
+def main(args=None):
+    if not args:
+        args = sys.argv[1:] or sorted(benchmarks)
+    for arg in args:
+        (name, eq, arg) = arg.partition("=")
+        if eq:
+            benchmarks[name](arg)
+        else:
+            benchmarks[name]()
+
+if __name__ == "__main__":
+    main()
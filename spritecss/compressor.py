@@ -4,23 +4,20 @@ Based on https://github.com/miracle2k/webassets/blob/master/src/webassets/filter
 from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import unicode_literals
-import datetime
 import os
 
-from six import StringIO
 from contextlib import contextmanager
 from compressor.conf import settings
 from compressor.filters import FilterBase
 
 try:
-    from spritecss.main import CSSFile
-    from spritecss.css import CSSParser
-    from spritecss.css.parser import iter_print_css
+    from spritecss.main import CSSFile, hashed_out
     from spritecss.config import CSSConfig
     from spritecss.mapper import SpriteMapCollector
     from spritecss.packing import PackedBoxes, print_packed_size
     from spritecss.packing.sprites import open_sprites
     from spritecss.packing.naive import naive_packing
+    from spritecss.packing.cache import PackingCache
     from spritecss.stitch import stitch
     from spritecss.replacer import SpriteReplacer
 
@@ -39,20 +36,16 @@ else:
 
         def __init__(self, fname, conf=None, data=''):
             super(FakeCSSFile, self).__init__(fname, conf=conf)
-            self.data = StringIO(data)
+            self.data = data
 
         @contextmanager
-        def open_parser(self):
-            yield CSSParser.read_file(self.data)
+        def open_data(self):
+            yield self.data
 
     class LocalCSSConfig(CSSConfig):
         def normpath(self, p):
             return super(LocalCSSConfig, self).normpath(p.lstrip(os.sep))
 
-        def get_spritemap_url(self, fname):
-            # Append version info to image - current timestamp
-            return "".join([super(LocalCSSConfig, self).get_spritemap_url(fname), '?', datetime.datetime.now().strftime('%Y%m%d%H%M%S')])
-
 
 __all__ = ('SpritemapperFilter',)
 
@@ -76,6 +69,14 @@ class SpritemapperFilter(FilterBase):
         Affects the number of combinations to be attempted by the box packer
         algorithm
 
+    COMPRESS_SPRITEMAPPER_CACHE_DIR
+        A directory in which to keep packing results between builds
+
+    COMPRESS_SPRITEMAPPER_HASH_URLS
+        How the spritemap URL changes with the image: ``'query'`` (the
+        default) appends a hash of it, ``'filename'`` names the image by
+        its hash
+
     **Note:** Since the ``spritemapper`` command-line utility expects source
     and output files to be on the filesystem, this filter interfaces directly
     with library internals instead. It has been tested to work with
@@ -97,6 +98,13 @@ class SpritemapperFilter(FilterBase):
         if anneal_steps:
             self.options['anneal_steps'] = anneal_steps
 
+        cache_dir = getattr(settings, 'COMPRESS_SPRITEMAPPER_CACHE_DIR', None)
+        if cache_dir:
+            self.options['cache_dir'] = cache_dir
+
+        self.options['hash_urls'] = getattr(
+            settings, 'COMPRESS_SPRITEMAPPER_HASH_URLS', 'query')
+
         self.options['output_image'] = os.path.join(settings.COMPRESS_OUTPUT_DIR, "sprite.png")
         self.options['base_url'] = settings.COMPRESS_URL
 
@@ -124,6 +132,7 @@ class SpritemapperFilter(FilterBase):
 
         # Generate spritemapped image
         # This code is almost verbatim from spritecss.main.spritemap
+        cache = PackingCache.from_conf(conf)
         sm_plcs = []
         for smap in smaps:
             with open_sprites(smap, pad=conf.padding) as sprites:
@@ -131,28 +140,25 @@ class SpritemapperFilter(FilterBase):
 
                 if conf.packer == 'annealing':
                     print("annealing %s in steps of %d" % (smap.fname, conf.anneal_steps))
-                    packed = PackedBoxes(sprites, anneal_steps=conf.anneal_steps)
+                    packed = PackedBoxes(sprites, anneal_steps=conf.anneal_steps,
+                                         cache=cache)
                     print_packed_size(packed)
                     sm_plcs.append((smap, packed.placements))
                     im = stitch(packed)
 
                 elif conf.packer == 'naive':
                     print("Naive packing")
-                    im, placements = naive_packing(sprites)
+                    im, placements = naive_packing(sprites, cache=cache)
                     sm_plcs.append((smap, placements))
 
                 print("writing spritemap image at %s" % (smap.fname,))
                 with open(smap.fname, "wb") as fp:
                     im.save(fp)
+                smap.fname = hashed_out(smap.fname, conf)
 
         # Instantiate a fake file instance again
         cssfile = FakeCSSFile(fname=source_path, conf=conf, data=css)
 
-        out = StringIO()
-
-        # Output rewritten CSS with spritemapped URLs
+        # Output rewritten CSS with spritemapped URLs, in one piece
         replacer = SpriteReplacer(sm_plcs)
-        for data in iter_print_css(replacer(cssfile)):
-            out.write(data)
-
-        return out.getvalue()
+        return "".join(replacer.iter_spliced(cssfile))
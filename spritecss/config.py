@@ -1,8 +1,11 @@
+import os
 import shlex
+import hashlib
 from os import path
+from functools import wraps
 from itertools import imap, ifilter
 from urlparse import urljoin
-from .css import CSSParser, iter_events
+from .css import scan_css, iter_events
 
 def parse_config_stmt(line, prefix="spritemapper."):
     line = line.strip()
@@ -13,6 +16,38 @@ def parse_config_stmt(line, prefix="spritemapper."):
 def iter_config_stmts(data):
     return ifilter(None, imap(parse_config_stmt, data.splitlines()))
 
+def parse_bool(value):
+    if isinstance(value, basestring):
+        return value.strip().lower() in ("1", "yes", "true", "on")
+    return bool(value)
+
+_digests = {}
+
+def file_digest(fname):
+    """Hex digest of the contents of *fname*, remembered for as long as the
+    file's size and modification time stay the same.
+    """
+    st = os.stat(fname)
+    key = (path.abspath(fname), st.st_size, st.st_mtime)
+    if key not in _digests:
+        with open(fname, "rb") as fp:
+            _digests[key] = hashlib.sha1(fp.read()).hexdigest()
+    return _digests[key]
+
+def _memoized(method):
+    """Remember what *method* gives for each argument, per config. Configs
+    don't change once set up, so neither do the results.
+    """
+    @wraps(method)
+    def wrapper(self, arg):
+        memo = self._memo.setdefault(method.__name__, {})
+        try:
+            return memo[arg]
+        except KeyError:
+            rv = memo[arg] = method(self, arg)
+            return rv
+    return wrapper
+
 def iter_css_config(parser):
     for ev in iter_events(parser, lexemes=("comment",)):
         for v in iter_config_stmts(ev.comment):
@@ -26,6 +61,7 @@ class CSSConfig(object):
         self._data = dict(base) if base else {}
         if parser is not None:
             self._data.update(iter_css_config(parser))
+        self._memo = {}
 
     def __iter__(self):
         # this is mostly so you can go CSSConfig(base=CSSConfig(..))
@@ -34,8 +70,9 @@ class CSSConfig(object):
     @classmethod
     def from_file(cls, fname):
         with open(fname, "rb") as fp:
-            return cls(CSSParser.from_file(fp), fname=fname)
+            return cls(scan_css(fp.read()), fname=fname)
 
+    @_memoized
     def normpath(self, p):
         """Normalize a possibly relative path *p* to the root."""
         return path.normpath(path.join(self.root, p))
@@ -58,8 +95,10 @@ class CSSConfig(object):
         elif self._data.get("output_image"):
             raise RuntimeError("cannot have sprite_dirs "
                                "when output_image is set")
-        sdirs = shlex.split(self._data["sprite_dirs"])
-        return map(self.normpath, sdirs)
+        if "sprite_dirs" not in self._memo:
+            sdirs = shlex.split(self._data["sprite_dirs"])
+            self._memo["sprite_dirs"] = map(self.normpath, sdirs)
+        return list(self._memo["sprite_dirs"])
 
     @property
     def output_image(self):
@@ -89,15 +128,119 @@ class CSSConfig(object):
     def anneal_steps(self):
         return int(self._data.get("anneal_steps", 9200))
 
+    @property
+    def source_map(self):
+        return parse_bool(self._data.get("source_map", False))
+
+    @property
+    def png_chunk_size(self):
+        return int(self._data.get("png_chunk_size", 2 ** 20))
+
+    @property
+    def png_threads(self):
+        return int(self._data.get("png_threads", 1))
+
+    @property
+    def cache_dir(self):
+        if "cache_dir" in self._data:
+            return self.normpath(self._data["cache_dir"])
+
+    @property
+    def max_size(self):
+        """Largest (width, height) of a spritemap, or None if unbounded."""
+        rv = self._data.get("max_size")
+        if not rv:
+            return None
+        if isinstance(rv, basestring):
+            rv = rv.lower().replace("x", " ").replace(",", " ").split()
+        elif isinstance(rv, (int, long)):
+            rv = (rv,)
+        rv = tuple(map(int, rv))
+        if len(rv) == 1:
+            rv *= 2
+        return rv
+
+    @property
+    def warm_start(self):
+        return parse_bool(self._data.get("warm_start", False))
+
+    @property
+    def warm_start_waste(self):
+        return float(self._data.get("warm_start_waste", 0.25))
+
+    @property
+    def split_by_usage(self):
+        return parse_bool(self._data.get("split_by_usage", False))
+
+    @property
+    def request_cost(self):
+        return int(self._data.get("request_cost", 2048))
+
+    @property
+    def retina(self):
+        return parse_bool(self._data.get("retina", False))
+
+    def get_retina_fname(self, fname):
+        "Get the double resolution sibling of image *fname*."
+        (base, ext) = path.splitext(fname)
+        return base + "@2x" + ext
+
+    @property
+    def extra_formats(self):
+        "Image formats to write alongside each PNG spritemap."
+        return shlex.split(self._data.get("extra_formats", ""))
+
+    def get_spritemap_format_out(self, fname, ext):
+        "Get output image filename for spritemap *fname* in another format."
+        return path.splitext(fname)[0] + ext
+
+    @property
+    def skip_unchanged(self):
+        return parse_bool(self._data.get("skip_unchanged", False))
+
+    def get_digest_out(self, fname):
+        "Get pixel digest filename for spritemap image *fname*."
+        return path.splitext(fname)[0] + ".digest"
+
+    @property
+    def hash_urls(self):
+        "How spritemap URLs change with their images, if at all."
+        rv = self._data.get("hash_urls") or None
+        if rv not in (None, "query", "filename"):
+            raise ValueError("hash_urls must be query or filename, not %r"
+                             % (rv,))
+        return rv
+
+    def get_spritemap_hashed_out(self, fname, digest):
+        "Get content-addressed filename for image *fname* with *digest*."
+        (base, ext) = path.splitext(fname)
+        return "%s.%s%s" % (base, digest[:12], ext)
+
+    def get_layout_out(self, fname):
+        "Get layout filename for spritemap *fname*."
+        return path.splitext(fname)[0] + ".layout"
+
     def get_spritemap_out(self, dn):
         "Get output image filename for spritemap directory *dn*."
         if "output_image" in self._data:
             return self.output_image
         return dn + ".png"
 
+    def get_spritemap_part_out(self, fname, n):
+        "Get output image filename for part *n* of split spritemap *fname*."
+        (base, ext) = path.splitext(fname)
+        return "%s-%d%s" % (base, n, ext)
+
+    @_memoized
+    def _get_spritemap_url(self, fname):
+        return self.absurl(path.relpath(fname, self.root)).replace('\\', '/')
+
     def get_spritemap_url(self, fname):
         "Get output image URL for spritemap *fname*."
-        return self.absurl(path.relpath(fname, self.root)).replace('\\', '/')
+        url = self._get_spritemap_url(fname)
+        if self.hash_urls == "query":
+            url += "?" + file_digest(fname)[:12]
+        return url
 
     def get_css_out(self, fname):
         "Get output image filename for spritemap directory *fname*."
@@ -112,11 +255,10 @@ class CSSConfig(object):
 
 def print_config(fname):
     from pprint import pprint
-    from .css import CSSParser
 
     with open(fname, "rb") as fp:
         print "%s\n%s\n" % (fname, "=" * len(fname))
-        pprint(dict(iter_css_config(CSSParser.read_file(fp))))
+        pprint(dict(iter_css_config(scan_css(fp.read()))))
         print
 
 def main():
@@ -6,10 +6,11 @@
 # Released under a MIT/X11 license
 
 from .parser import CSSParser, print_css
+from .scan import scan_css
 from itertools import ifilter, imap
 
 __all__ = ["CSSParser", "iter_events", "split_declaration",
-           "print_css", "iter_declarations"]
+           "print_css", "iter_declarations", "scan_css"]
 
 def iter_events(parser, lexemes=None, predicate=None):
     if lexemes and predicate:
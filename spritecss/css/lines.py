@@ -0,0 +1,29 @@
+"""Line numbers from offsets
+
+The tokenizer only keeps track of offsets. Line and column numbers are looked
+up in an index of where each line starts, built on the first lookup -- so they
+cost nothing unless a message actually mentions one.
+"""
+
+from bisect import bisect_right
+
+class LineIndex(object):
+    """Index of the line starts of *data*, a string or anything else with a
+    `find` method like it.
+    """
+
+    def __init__(self, data):
+        starts = [0]
+        find = data.find
+        idx = find("\n")
+        while idx != -1:
+            starts.append(idx + 1)
+            idx = find("\n", idx + 1)
+        self.starts = starts
+
+    def position(self, offset):
+        """Give the line and column number of *offset*, both counted from
+        one.
+        """
+        line_no = bisect_right(self.starts, offset)
+        return (line_no, offset - self.starts[line_no - 1] + 1)
@@ -15,6 +15,9 @@ following lexemes:
 - "declaration"
 - "block_end"
 - "whitespace"
+- "at_block"
+- "at_statement"
+- "verbatim" (only from `spritecss.css.scan`)
 """
 
 import sys
@@ -85,19 +88,17 @@ class Token(object):
     "dumb" means "lexed as such without consideration for surrounding context"
     """
 
-    __slots__ = ("lexeme", "value", "line_no", "col_no")
+    __slots__ = ("lexeme", "value", "offset")
 
-    def __init__(self, lexeme="char", value=None, line_no=None, col_no=None):
+    def __init__(self, lexeme="char", value=None, offset=None):
         self.lexeme = lexeme
         self.value = value
-        self.line_no = line_no
-        self.col_no = col_no
+        self.offset = offset
 
     def __repr__(self):
         clsname = type(self).__name__
-        return ("%s(%r, %r, line_no=%r, col_no=%r)"
-                % (clsname, self.lexeme, self.value,
-                   self.line_no, self.col_no))
+        return ("%s(%r, %r, offset=%r)"
+                % (clsname, self.lexeme, self.value, self.offset))
 
     def __eq__(self, other):
         if hasattr(other, "lexeme") and hasattr(other, "value"):
@@ -105,6 +106,12 @@ class Token(object):
                     other.value == self.value
         return NotImplemented
 
+def _join_values(toks):
+    """Concatenate the values of *toks* in one go, rather than growing a
+    string token by token.
+    """
+    return "".join([tok.value for tok in toks])
+
 def _bytestream(chunks):
     """Yield each byte of a set of chunks."""
     for chunk in chunks:
@@ -199,22 +206,20 @@ def _css_tokenizer_lvl1(chars):
             tok.lexeme = "char"
         yield tok
 
-def _css_tokenizer_lineno(toks):
-    """Tokenize and count line numbers. Yields states."""
-    col_no = 1
-    line_no = 1
+def _css_tokenizer_offsets(toks, offset=0):
+    """Tokenize and count offsets, starting from *offset*. Yields states.
+
+    Line numbers are left for `spritecss.css.lines` to work out when needed.
+    """
     for tok in toks:
-        tok.line_no = line_no
-        tok.col_no = col_no
+        tok.offset = offset
         yield tok
-        if tok.lexeme == "w" and tok.value == "\n":
-            col_no = 1
-            line_no += 1
-        else:
-            col_no += 1
+        if tok.value:
+            offset += len(tok.value)
 
-def css_tokenize(it):
-    return _css_tokenizer_lineno(_css_tokenizer_lvl1(_bytestream(it)))
+def css_tokenize(it, offset=0):
+    return _css_tokenizer_offsets(_css_tokenizer_lvl1(_bytestream(it)),
+                                  offset=offset)
 
 def css_tokenize_data(css):
     return css_tokenize([css])
@@ -225,7 +230,7 @@ class CSSParseState(object):
     __slots__ = ("handler", "prev", "counter",
                  "tokens", "token",
                  "selector", "declaration", "at_rule",
-                 "comment", "whitespace")
+                 "comment", "whitespace", "declaration_start")
 
     ## general
     # tokens: iterator over remaining tokens
@@ -236,6 +241,7 @@ class CSSParseState(object):
     # selector: current selector
     # declaration: current declaration
     # at_rule: current at rule
+    # declaration_start: offset of the current declaration
 
     ## uninteresting buffers
     # comment: comment buffer
@@ -252,6 +258,7 @@ class CSSParseState(object):
         self.at_rule = ""
         self.comment = ""
         self.whitespace = ""
+        self.declaration_start = None
 
     def __call__(self, data=None, **kwds):
         if data is not None:
@@ -322,66 +329,87 @@ class CSSParseState(object):
             tok = self.next()
 
     @classmethod
-    def from_chunks(cls, chunks, **kwds):
+    def from_chunks(cls, chunks, offset=0, **kwds):
         """Set up a CSS parser state from iterable *chunks* which generates
-        blocks of code.
+        blocks of code, the first of which starts at *offset*.
         """
-        return cls(tokens=css_tokenize(chunks), **kwds)
+        return cls(tokens=css_tokenize(chunks, offset=offset), **kwds)
 
 # {{{ event defs
+def _text_alias(name):
+    return property(lambda self: self.text,
+                    doc="The %s text of this event (read-only)." % (name,))
+
 class CSSParserEvent(object):
-    __slots__ = ("state",)
+    """A parser event: its text and the offset of the token which ended it.
 
-    def __init__(self, state):
-        self.state = state
+    Events hold no reference to the parser state, so keeping a list of them
+    around costs little more than the text itself.
+    """
+
+    __slots__ = ("text", "offset")
+
+    def __init__(self, text="", offset=None):
+        self.text = text
+        self.offset = offset
+
+    @classmethod
+    def from_state(cls, state, text="", *args):
+        return cls(text, state.token.offset, *args)
+
+    def __repr__(self):
+        return ("%s(%r, offset=%r)"
+                % (type(self).__name__, self.text, self.offset))
 
 class Selector(CSSParserEvent):
     lexeme = "selector"
-    __slots__ = ("selector",)
-
-    def __init__(self, state=None, selector=None):
-        self.state = state
-        self.selector = selector if selector else state.selector
+    __slots__ = ()
+    selector = _text_alias("selector")
 
 class AtRule(CSSParserEvent):
-    __slots__ = ("at_rule",)
-
-    def __init__(self, state=None, at_rule=None):
-        self.state = state
-        self.at_rule = at_rule if at_rule else state.at_rule
+    __slots__ = ()
+    at_rule = _text_alias("at-rule")
 
 class AtBlock(AtRule):
     lexeme = "at_block"
+    __slots__ = ()
 
 class AtStatement(AtRule):
     lexeme = "at_statement"
+    __slots__ = ()
 
 class Comment(CSSParserEvent):
     lexeme = "comment"
-    __slots__ = ("comment",)
-
-    def __init__(self, state=None, comment=None):
-        self.state = state
-        self.comment = comment if comment else state.comment
+    __slots__ = ()
+    comment = _text_alias("comment")
 
 class Declaration(CSSParserEvent):
+    """A declaration, whose code spans from offset `start` up to the
+    terminating semicolon or block end at `offset`.
+    """
     lexeme = "declaration"
-    __slots__ = ("declaration",)
+    __slots__ = ("start",)
+    declaration = _text_alias("declaration")
 
-    def __init__(self, state=None, declaration=None):
-        self.state = state
-        self.declaration = declaration if declaration else state.declaration
+    def __init__(self, text="", offset=None, start=None):
+        super(Declaration, self).__init__(text, offset)
+        self.start = start
 
 class BlockEnd(CSSParserEvent):
     lexeme = "block_end"
+    __slots__ = ()
 
 class Whitespace(CSSParserEvent):
     lexeme = "whitespace"
-    __slots__ = ("whitespace")
+    __slots__ = ()
+    whitespace = _text_alias("whitespace")
 
-    def __init__(self, state=None, whitespace=None):
-        self.state = state
-        self.whitespace = whitespace if whitespace else state.whitespace
+class Verbatim(CSSParserEvent):
+    """A span of code passed through unparsed, starting at `offset`; see
+    `spritecss.css.scan`.
+    """
+    lexeme = "verbatim"
+    __slots__ = ()
 # }}}
 
 INLINE_AT_RULES = ('-ms-viewport', 'viewport', 'font-face')
@@ -415,12 +443,12 @@ class CSSParser(EventStream):
         except OutOfTokens:
             return
 
-    def iter_print_css(self, converter=None):
+    def iter_print_css(self, converter=None, buffer_size=None):
         """Iterator over printable the CSS code."""
         evs = self.iter_events()
         if converter:
             evs = imap(converter, evs)
-        return iter_print_css(evs)
+        return iter_print_css(evs, buffer_size=buffer_size)
 
     def evaluate(self, st=None):
         if st is None:
@@ -451,38 +479,36 @@ class CSSParser(EventStream):
             return st(handler=self._handle_eof)
 
     def _handle_comment(self, st):
-        for tok in st.iter_tokens(("char",)):
-            st.comment += tok.value
+        st.comment += _join_values(st.iter_tokens(("char",)))
 
         if st.lexeme == "comment_end":
-            self.push(Comment(st))
+            self.push(Comment.from_state(st, st.comment))
             return st.leave()
 
     def _handle_selector(self, st):
-        for tok in st.iter_tokens(("char", "w")):
-            st.selector += tok.value
+        st.selector += _join_values(st.iter_tokens(("char", "w")))
 
         lex = st.lexeme
         if lex == "block_begin":
-            self.push(Selector(st))
+            self.push(Selector.from_state(st, st.selector))
             return st(handler=self._handle_declaration)
         elif lex == "comment_begin":
             return st.sub(self._handle_whitespace)
 
     def _handle_declaration(self, st):
         if not st.declaration:
-            for tok in st.iter_tokens(("w",)):
-                st.whitespace += tok.value
+            st.whitespace += _join_values(st.iter_tokens(("w",)))
             if st.whitespace:
-                self.push(Whitespace(st))
+                self.push(Whitespace.from_state(st, st.whitespace))
                 st = st(whitespace="")
+            st.declaration_start = st.token.offset
 
-        for tok in st.iter_tokens(("char", "w")):
-            st.declaration += tok.value
+        st.declaration += _join_values(st.iter_tokens(("char", "w")))
 
         lex = st.lexeme
         if lex == "semicolon":
-            self.push(Declaration(st))
+            self.push(Declaration.from_state(st, st.declaration,
+                                             st.declaration_start))
             return st(declaration="")
         elif lex == "comment_begin":
             return st.sub(self._handle_comment)
@@ -490,28 +516,27 @@ class CSSParser(EventStream):
             # This happens when the last declaration isn't terminated with a
             # semicolon, which is valid (and often occurs during minimization)
             if st.declaration:
-                self.push(Declaration(st))
-            self.push(BlockEnd(st))
+                self.push(Declaration.from_state(st, st.declaration,
+                                                 st.declaration_start))
+            self.push(BlockEnd.from_state(st))
             return st.leave()
         elif lex == "w":
             return st.sub(self._handle_whitespace)
 
     def _handle_at_rule(self, st):
         if not st.at_rule:
-            for tok in st.iter_tokens(("char", "w")):
-                st.at_rule += tok.value
+            st.at_rule += _join_values(st.iter_tokens(("char", "w")))
         else:
             if st.at_rule in INLINE_AT_RULES:
                 st.at_rule = ""
                 return st.leave()
 
-            for tok in st.iter_tokens(("w",)):
-                st.at_rule += tok.value
+            st.at_rule += _join_values(st.iter_tokens(("w",)))
 
             lex = st.lexeme
 
             if lex == 'block_end':
-                self.push(BlockEnd(st))
+                self.push(BlockEnd.from_state(st))
                 st.at_rule = ""
                 return st.leave()
 
@@ -523,24 +548,23 @@ class CSSParser(EventStream):
         lex = st.lexeme
 
         if lex == "block_begin":
-            self.push(AtBlock(st))
+            self.push(AtBlock.from_state(st, st.at_rule))
             if st.at_rule in INLINE_AT_RULES:
                 return st.sub(self._handle_declaration)
             return st.sub(self._handle_selector)
         elif lex == "semicolon":
-            self.push(AtStatement(st))
+            self.push(AtStatement.from_state(st, st.at_rule))
             return st(handler=None, at_rule="")
         elif lex == "comment_begin":
             return st.sub(self._handle_comment)
         elif lex == "block_end":
-            self.push(BlockEnd(st))
+            self.push(BlockEnd.from_state(st))
             return st.leave()
 
     def _handle_whitespace(self, st):
-        for tok in st.iter_tokens(("w",)):
-            st.whitespace += tok.value
+        st.whitespace += _join_values(st.iter_tokens(("w",)))
 
-        self.push(Whitespace(st))
+        self.push(Whitespace.from_state(st, st.whitespace))
         # because the current token is "unconsumed" (i.e. was not whitespace),
         # we need to ask the default handler what to return
         return self._handle_any(st.leave())
@@ -548,10 +572,45 @@ class CSSParser(EventStream):
     def _handle_eof(self, st):
         raise IOError("cannot parse beyond end of file")
 
-def iter_print_css(parser):
+#: default size of the blocks print_css writes
+BUFFER_SIZE = 2 ** 16
+
+def iter_buffered(chunks, buffer_size=BUFFER_SIZE):
+    """Join the strings of *chunks* into blocks of at least *buffer_size*
+    characters, but the last. Chunks that large by themselves pass through as
+    they are.
+    """
+    buf = []
+    size = 0
+    for chunk in chunks:
+        if len(chunk) >= buffer_size:
+            if buf:
+                yield "".join(buf)
+                buf = []
+                size = 0
+            yield chunk
+            continue
+        buf.append(chunk)
+        size += len(chunk)
+        if size >= buffer_size:
+            yield "".join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield "".join(buf)
+
+def iter_print_css(parser, buffer_size=None):
+    """Iterate over the code of an event stream of CSS parser events, joined
+    into blocks of *buffer_size* if given.
+    """
+    if buffer_size:
+        return iter_buffered(_iter_print_css(parser), buffer_size)
+    return _iter_print_css(parser)
+
+def _iter_print_css(parser):
     for event in parser:
         if event.lexeme == "comment":
-            yield u"/*{0}*/".format(event.comment)
+            yield "/*%s*/" % (event.comment,)
         elif event.lexeme == "selector":
             yield event.selector + "{"
         elif event.lexeme == "declaration":
@@ -564,12 +623,16 @@ def iter_print_css(parser):
             yield "@%s{" % (event.at_rule,)
         elif event.lexeme == "at_statement":
             yield "@%s;" % (event.at_rule,)
+        elif event.lexeme == "verbatim":
+            yield event.text
         else:
             raise RuntimeError("unknown event %s" % (event,))
 
-def print_css(parser, out=sys.stdout):
-    """Print an event stream of CSS parser events."""
-    for data in iter_print_css(parser):
+def print_css(parser, out=sys.stdout, buffer_size=BUFFER_SIZE):
+    """Print an event stream of CSS parser events, writing blocks of
+    *buffer_size*.
+    """
+    for data in iter_print_css(parser, buffer_size=buffer_size):
         out.write(data)
 
 def main():
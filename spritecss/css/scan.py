@@ -0,0 +1,59 @@
+"""Fast scanning of CSS for the few parts spritemapper cares about
+
+Spritemapper only looks at declarations with a ``url(`` in them and at
+comments holding ``spritemapper.`` options, so tokenizing every character of
+a stylesheet one by one is mostly wasted effort.
+
+Instead, the code is cut up into *segments* -- runs of code ending with a
+closing brace at nesting level zero -- by a regular expression which only
+stops at braces, comments and strings. A segment is in the same state as the
+start of a file, so each one that contains any of the interesting substrings
+is parsed by itself with the full `CSSParser`. The rest pass through as
+"verbatim" events, which print as the exact code they cover.
+"""
+
+import re
+
+from .parser import CSSParser, CSSParseState, Verbatim
+
+#: substrings which make a segment worth parsing
+SPRITE_NEEDLES = ("url(", "spritemapper.")
+
+# comments first, as the tokenizer lets them begin even inside of strings
+_boundary_re = re.compile(r"""
+    /\*.*?(?:\*/|\Z)
+  | "[^"\\]*(?:\\.[^"\\]*)*"
+  | '[^'\\]*(?:\\.[^'\\]*)*'
+  | ([{}])
+""", re.S | re.X)
+
+def iter_segments(data):
+    """Yield the (start, end) offsets of the top-level segments of *data*."""
+    depth = 0
+    start = 0
+    for mo in _boundary_re.finditer(data):
+        brace = mo.group(1)
+        if brace == "{":
+            depth += 1
+        elif brace == "}":
+            depth = max(0, depth - 1)
+            if not depth:
+                yield (start, mo.end())
+                start = mo.end()
+    if start < len(data):
+        yield (start, len(data))
+
+def scan_css(data, needles=SPRITE_NEEDLES):
+    """Iterate over parser events for the segments of *data* which contain
+    any of *needles*, and verbatim events for the rest.
+    """
+    for (start, end) in iter_segments(data):
+        seg = data[start:end]
+        for needle in needles:
+            if needle in seg:
+                st = CSSParseState.from_chunks([seg], offset=start)
+                for ev in CSSParser(st):
+                    yield ev
+                break
+        else:
+            yield Verbatim(seg, start)
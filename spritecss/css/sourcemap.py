@@ -0,0 +1,87 @@
+"""Source maps for rewritten stylesheets
+
+Rewriting copies most of a stylesheet as it is, so mapping the start of each
+copied line and of each piece of generated code back to the original is all
+it takes for a browser to point at the right rule. See the source map v3
+format for the details of the encoding.
+"""
+
+import json
+
+_b64chars = ("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+             "0123456789+/")
+
+def encode_vlq(value):
+    """Encode integer *value* as a base64 variable-length quantity."""
+    value = ((-value) << 1) | 1 if value < 0 else value << 1
+    digits = []
+    while True:
+        digit = value & 31
+        value >>= 5
+        if value:
+            digit |= 32
+        digits.append(_b64chars[digit])
+        if not value:
+            return "".join(digits)
+
+class SourceMap(object):
+    """Source map of a stylesheet generated from one with the line index
+    *line_index*, built up in the order the output is written.
+    """
+
+    def __init__(self, line_index):
+        self.line_index = line_index
+        #: (column, source line, source column) segments of each output line
+        self.lines = [[]]
+        self.col = 0
+
+    def _segment(self, offset):
+        (line_no, col_no) = self.line_index.position(offset)
+        self.lines[-1].append((self.col, line_no - 1, col_no - 1))
+
+    def _newline(self):
+        self.lines.append([])
+        self.col = 0
+
+    def add_copy(self, data, start, end):
+        """Map code copied from *data* between offsets *start* and *end*."""
+        pos = start
+        while pos < end:
+            self._segment(pos)
+            idx = data.find("\n", pos, end)
+            if idx == -1:
+                self.col += end - pos
+                break
+            self._newline()
+            pos = idx + 1
+
+    def add_code(self, code, offset):
+        """Map generated *code* to the original code at *offset*."""
+        for (n, line) in enumerate(code.split("\n")):
+            if n:
+                self._newline()
+            if line:
+                self._segment(offset)
+                self.col += len(line)
+
+    @property
+    def mappings(self):
+        prev_line = prev_col = 0
+        rv = []
+        for segments in self.lines:
+            parts = []
+            gen_col = 0
+            for (col, line, src_col) in segments:
+                parts.append(encode_vlq(col - gen_col) + encode_vlq(0) +
+                             encode_vlq(line - prev_line) +
+                             encode_vlq(src_col - prev_col))
+                (gen_col, prev_line, prev_col) = (col, line, src_col)
+            rv.append(",".join(parts))
+        return ";".join(rv)
+
+    def dump(self, fp, fname, source):
+        """Write the source map of *fname*, generated from *source*, as JSON
+        to *fp*.
+        """
+        json.dump({"version": 3, "file": fname, "sources": [source],
+                   "names": [], "mappings": self.mappings}, fp)
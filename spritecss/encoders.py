@@ -0,0 +1,61 @@
+"""Encoders for alternative spritemap image formats
+
+PNG output is always written by the bundled png module. Other formats depend
+on whatever libraries happen to be installed, and are skipped with a warning
+when none is. Encoders are looked up by format name in `encoders`.
+"""
+
+from .stitch import iter_rescaled
+
+try:
+    from PIL import Image as PILImage, features as pil_features
+except ImportError:
+    PILImage = None
+
+#: format name => encoder class
+encoders = {}
+
+class EncoderUnavailable(Exception):
+    pass
+
+def register(fmt):
+    def decorator(cls):
+        encoders[fmt] = cls
+        return cls
+    return decorator
+
+def _row_bytes(row):
+    if hasattr(row, "tostring"):
+        return row.tostring()
+    return str(row)
+
+@register("webp")
+class PillowWebPEncoder(object):
+    """Encode WebP using Pillow, losslessly by default. WebP has no more
+    than 8 bits per sample, so deeper images are scaled down.
+    """
+
+    extension = ".webp"
+    mime_type = "image/webp"
+
+    def __init__(self, lossless=True, quality=100):
+        if PILImage is None:
+            raise EncoderUnavailable("webp output requires Pillow")
+        if not pil_features.check("webp"):
+            raise EncoderUnavailable("Pillow was built without webp support")
+        self.lossless = lossless
+        self.quality = quality
+
+    def encode(self, im, fo):
+        rows = iter_rescaled(im.pixels, im.bitdepth, 8)
+        data = "".join(_row_bytes(row) for row in rows)
+        pil_im = PILImage.frombytes("RGBA", im.size, data)
+        pil_im.save(fo, "WEBP", lossless=self.lossless, quality=self.quality)
+
+def get_encoder(fmt, **kwds):
+    """Get an encoder for format *fmt*, or raise EncoderUnavailable."""
+    try:
+        cls = encoders[fmt]
+    except KeyError:
+        raise EncoderUnavailable("unknown image format %r" % (fmt,))
+    return cls(**kwds)
@@ -54,11 +54,12 @@ def find_decl_background_url(decl):
 
 class SpriteEvent(object):
     lexeme = "spriteref"
+    __slots__ = ("declaration", "sprite", "offset")
 
     def __init__(self, ev, sprite):
-        self.state = ev.state
         self.declaration = ev.declaration
         self.sprite = sprite
+        self.offset = ev.offset
 
 def iter_spriterefed(evs, conf=None, source=None, root=None):
     if source and not root:
@@ -92,12 +93,12 @@ def find_sprite_refs(*args, **kwds):
 def main():
     import sys
     import json
-    from .css import CSSParser
+    from .css import scan_css
     for fname in sys.argv[1:]:
         with open(fname, "rb") as fp:
             print >>sys.stderr, "extracting from", fname
-            parser = CSSParser.read_file(fp)
-            srefs = map(str, find_sprite_refs(parser, source=fname))
+            evs = scan_css(fp.read())
+            srefs = map(str, find_sprite_refs(evs, source=fname))
             v = [fname, srefs]
             json.dump(v, sys.stdout, indent=2)
 
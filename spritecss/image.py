@@ -1,3 +1,6 @@
+import os
+import hashlib
+
 from . import png
 
 # TODO Image class should abstract `pixels`
@@ -16,12 +19,62 @@ class Image(object):
         self.close = fo.close
         return self
 
-    def save(self, fo):
+    def save(self, fo, chunk_limit=None, threads=1):
+        """Write as PNG to *fo*, compressing rows as they are produced.
+
+        *chunk_limit* is the approximate size of each IDAT chunk, and
+        *threads* the number of threads to compress with.
+        """
         kwds = self._meta.copy()
-        for k in ("size", "width", "height", "bitdepth"):
+        for k in ("size", "width", "height"):
             kwds.pop(k, None)
+        if chunk_limit:
+            kwds["chunk_limit"] = chunk_limit
         w = png.Writer(size=self.size, **kwds)
-        w.write(fo, self.pixels)
+        if w.interlace or w.rescale:
+            w.write(fo, self.pixels)
+            return
+        with w.stream(fo, threads=threads) as sw:
+            sw.write_rows(self.pixels)
+
+    def save_if_changed(self, fname, digest_fname, **kwds):
+        """Write as PNG to *fname*, unless it exists and its pixels are
+        the same as when *digest_fname* was written alongside it. Gives
+        whether the file was written.
+        """
+        self.reusable()
+        digest = self.digest()
+        try:
+            with open(digest_fname, "rb") as fp:
+                prev_digest = fp.read().strip()
+        except IOError:
+            prev_digest = None
+        if prev_digest == digest and os.path.exists(fname):
+            return False
+        # a stale digest must not outlive a failed write
+        if prev_digest is not None:
+            os.remove(digest_fname)
+        with open(fname, "wb") as fp:
+            self.save(fp, **kwds)
+        with open(digest_fname, "wb") as fp:
+            fp.write(digest + "\n")
+        return True
+
+    def digest(self):
+        """Hex digest of the size, depth and pixel rows of the image."""
+        h = hashlib.sha1("%dx%d/%d\n" % (self.width, self.height,
+                                          self.bitdepth))
+        for row in self.pixels:
+            h.update(row)
+        return h.hexdigest()
+
+    def reusable(self):
+        """Make sure pixels can be iterated over more than once, so the same
+        stitched rows can be fed to several encoders.
+        """
+        if not isinstance(self.pixels, list):
+            self.pixels = list(self.pixels)
+        return self
 
     @property
     def size(self):
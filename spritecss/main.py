@@ -1,32 +1,86 @@
+import os
 import sys
+import mmap
+import shutil
 import logging
+import tempfile
 import optparse
 from os import path, access, R_OK
 from itertools import ifilter
 from contextlib import contextmanager
 
-from spritecss.css import CSSParser, print_css
-from spritecss.config import CSSConfig
+from spritecss import SpriteMap
+from spritecss.css import scan_css
+from spritecss.css.parser import iter_buffered
+from spritecss.css.lines import LineIndex
+from spritecss.css.sourcemap import SourceMap
+from spritecss.config import CSSConfig, file_digest
 from spritecss.finder import find_sprite_refs
 from spritecss.mapper import SpriteMapCollector, mapper_from_conf
-from spritecss.packing import PackedBoxes, print_packed_size
+from spritecss.packing import PackedBoxes, print_packed_size, \
+                              dump_packing_stats
+from spritecss.packing.cache import PackingCache
 from spritecss.packing.sprites import open_sprites
-from spritecss.packing.naive import naive_packing
-from spritecss.stitch import stitch
+from spritecss.packing.naive import naive_pack
+from spritecss.packing.warm import read_layout, write_layout, warm_packing
+from spritecss.packing.split import split_packing
+from spritecss.stitch import stitch, paste
 from spritecss.replacer import SpriteReplacer
+from spritecss.encoders import get_encoder, EncoderUnavailable
 
 logger = logging.getLogger(__name__)
 
+#: stylesheets at least this large are memory-mapped rather than read
+mmap_threshold = 2 ** 20
+
+@contextmanager
+def _open_data(fp):
+    """Give the contents of file *fp*, memory-mapped if it is large."""
+    if os.fstat(fp.fileno()).st_size < mmap_threshold:
+        fp.seek(0)
+        yield fp.read()
+    else:
+        data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield data
+        finally:
+            data.close()
+
 # TODO CSSFile should probably fit into the bigger picture
 class CSSFile(object):
+    _line_index = None
+    _mapper = None
+
     def __init__(self, fname, conf=None):
         self.fname = fname
         self.conf = conf
 
     @contextmanager
-    def open_parser(self):
+    def open_data(self):
         with open(self.fname, "rb") as fp:
-            yield CSSParser.read_file(fp)
+            with _open_data(fp) as data:
+                yield data
+
+    @contextmanager
+    def open_output(self):
+        with open(self.output_fname, "wb") as fp:
+            yield fp
+
+    @contextmanager
+    def open_parser(self):
+        with self.open_data() as data:
+            yield scan_css(data)
+
+    @property
+    def line_index(self):
+        if self._line_index is None:
+            with self.open_data() as data:
+                self._line_index = LineIndex(data)
+        return self._line_index
+
+    def position(self, offset):
+        """Give the line and column number of *offset* in this file."""
+        return self.line_index.position(offset)
 
     @classmethod
     def open_file(cls, fname, conf=None):
@@ -35,12 +89,19 @@ class CSSFile(object):
 
     @property
     def mapper(self):
-        return mapper_from_conf(self.conf)
+        # made once for each config the file has had
+        if self._mapper is None or self._mapper[0] is not self.conf:
+            self._mapper = (self.conf, mapper_from_conf(self.conf))
+        return self._mapper[1]
 
     @property
     def output_fname(self):
         return self.conf.get_css_out(self.fname)
 
+    @property
+    def source_map_fname(self):
+        return self.output_fname + ".map"
+
     def map_sprites(self):
         with self.open_parser() as p:
             srefs = find_sprite_refs(p, conf=self.conf, source=self.fname)
@@ -57,14 +118,176 @@ class InMemoryCSSFile(CSSFile):
     def __init__(self, *a, **k):
         sup = super(InMemoryCSSFile, self)
         sup.__init__(*a, **k)
-        with sup.open_parser() as p:
-            self._evs = list(p)
+        with sup.open_data() as data:
+            self._data = data[:]
+        self._evs = list(scan_css(self._data))
+
+    @contextmanager
+    def open_data(self):
+        yield self._data
 
     @contextmanager
     def open_parser(self):
         yield self._evs
 
-def spritemap(css_fs, conf=None, out=sys.stderr):
+def _seekable(fp):
+    try:
+        fp.seek(0, os.SEEK_CUR)
+    except (IOError, OSError):
+        return False
+    return True
+
+class StreamCSSFile(CSSFile):
+    """A stylesheet read from file object *fp* -- standard input, say -- and
+    written to file object *out*.
+
+    Relative URLs are taken to be relative to the working directory.
+    """
+
+    output_fname = "standard output"
+    source_map_fname = None
+
+    def __init__(self, fname, conf=None, fp=None, out=None):
+        super(StreamCSSFile, self).__init__(fname, conf=conf)
+        self.fp = fp
+        self.out = out
+
+    @classmethod
+    def open_stream(cls, fp, out, conf=None, fname="-"):
+        """Set up a stylesheet from *fp*. Pipes and the like can't be read
+        more than once, so they are copied to a temporary file first.
+        """
+        if not _seekable(fp):
+            spool = tempfile.TemporaryFile()
+            shutil.copyfileobj(fp, spool)
+            spool.flush()
+            spool.seek(0)
+            fp = spool
+        css = cls(fname, fp=fp, out=out)
+        with css.open_parser() as p:
+            css.conf = CSSConfig(p, base=conf, root=os.curdir)
+        return css
+
+    @contextmanager
+    def open_data(self):
+        with _open_data(self.fp) as data:
+            yield data
+
+    @contextmanager
+    def open_output(self):
+        yield self.out
+
+def _warm_packing(sprites, layout_fn, conf):
+    try:
+        layout = read_layout(layout_fn)
+    except IOError:
+        return None
+    except ValueError, e:
+        logger.warn("%s: invalid layout file: %s", layout_fn, e)
+        return None
+    packing = warm_packing(sprites, layout, max_waste=conf.warm_start_waste)
+    max_size = conf.max_size
+    if packing and max_size and (packing.width > max_size[0] or
+                                 packing.height > max_size[1]):
+        return None
+    return packing
+
+def _pack_sprites(sprites, conf, cache, max_size=None):
+    """Pack *sprites* using the configured packer, giving a tuple of the
+    packing, its placements and the spritemap image.
+    """
+    if conf.packer == 'annealing':
+        packed = PackedBoxes(sprites, anneal_steps=conf.anneal_steps,
+                             cache=cache, max_size=max_size)
+        return (packed, packed.placements, stitch(packed))
+    elif conf.packer == 'naive':
+        packed = naive_pack(sprites, cache=cache, max_size=max_size)
+        return (packed, list(packed), packed.render())
+    raise ValueError("unknown packer %r" % (conf.packer,))
+
+def _write_retina(fname, placements, size, conf):
+    """Write a double resolution version of spritemap *fname* from the @2x
+    siblings of its sprites, using the same layout. Gives the retina
+    fname, or None if not every sprite has a suitable sibling.
+    """
+    retina_fns = [conf.get_retina_fname(str(sprite.fname))
+                  for (pos, sprite) in placements]
+    missing = [fn for fn in retina_fns if not access(fn, R_OK)]
+    if missing:
+        if len(missing) < len(retina_fns):
+            logger.warn("%s: %d sprites lack @2x versions, e.g. %s",
+                        fname, len(missing), missing[0])
+        return None
+
+    with open_sprites(retina_fns) as retina_sprites:
+        if len(retina_sprites) != len(placements):
+            return None
+        pieces = []
+        for ((x, y), sprite), hi in zip(placements, retina_sprites):
+            if hi.size != (2 * sprite.width, 2 * sprite.height):
+                logger.warn("%s: not twice the size of %s",
+                            hi.fname, sprite.fname)
+                return None
+            pieces.append(((2 * x, 2 * y), hi.im))
+        im = paste((2 * size[0], 2 * size[1]), pieces)
+        retina_fn = conf.get_retina_fname(fname)
+        _save_image(im, retina_fn, conf)
+    return retina_fn
+
+def _save_image(im, fname, conf):
+    """Write spritemap image *im* to *fname*, unless skip_unchanged is set
+    and its pixels are the same as last time. Gives whether it was written.
+    """
+    kwds = dict(chunk_limit=conf.png_chunk_size, threads=conf.png_threads)
+    if conf.skip_unchanged:
+        return im.save_if_changed(fname, conf.get_digest_out(fname), **kwds)
+    with open(fname, "wb") as fp:
+        im.save(fp, **kwds)
+    return True
+
+def hashed_out(fname, conf):
+    """Copy image *fname* to its content-addressed name if hash_urls is
+    set to filename, giving the name the CSS should refer to.
+    """
+    if conf.hash_urls != "filename":
+        return fname
+    hashed_fn = conf.get_spritemap_hashed_out(fname, file_digest(fname))
+    if not path.exists(hashed_fn):
+        shutil.copyfile(fname, hashed_fn)
+    return hashed_fn
+
+def _get_encoders(conf):
+    encoders = []
+    for fmt in conf.extra_formats:
+        try:
+            encoders.append(get_encoder(fmt))
+        except EncoderUnavailable, e:
+            logger.warn("not writing %s spritemaps: %s", fmt, e)
+    return encoders
+
+def _write_css(css, replacer):
+    """Write the rewritten *css*, along with a source map if configured.
+    Gives the file name of the source map, if any.
+    """
+    source_map = map_fn = None
+    if css.conf.source_map and css.source_map_fname:
+        source_map = SourceMap(css.line_index)
+        map_fn = css.source_map_fname
+    with css.open_output() as fp:
+        spliced = replacer.iter_spliced(css, source_map=source_map)
+        for data in iter_buffered(spliced):
+            fp.write(data)
+        if map_fn:
+            fp.write("\n/*# sourceMappingURL=%s */\n" %
+                     (path.basename(map_fn),))
+    if map_fn:
+        source = path.relpath(css.fname, path.dirname(map_fn))
+        with open(map_fn, "wb") as fp:
+            source_map.dump(fp, path.basename(css.output_fname),
+                            source.replace("\\", "/"))
+    return map_fn
+
+def spritemap(css_fs, conf=None, out=sys.stderr, stats_out=None):
     w_ln = lambda t: out.write(t + "\n")
 
     #: sum of all spritemaps used from any css files
@@ -75,42 +298,110 @@ def spritemap(css_fs, conf=None, out=sys.stderr):
         for sm in smaps.collect(css.map_sprites()):
             w_ln(" - %s" % (sm.fname,))
 
+    if conf.split_by_usage:
+        smaps = list(smaps.iter_usage_split(request_cost=conf.request_cost))
+
     # Weed out single-image spritemaps (these make no sense.)
     smaps = [sm for sm in smaps if len(sm) > 1]
 
+    cache = PackingCache.from_conf(conf)
+    encoders = _get_encoders(conf)
+
     sm_plcs = []
     for smap in smaps:
         with open_sprites(smap, pad=conf.padding) as sprites:
             w_ln("packing sprites in mapping %s" % (smap.fname,))
 
-            if conf.packer == 'annealing':
-                logger.debug("annealing %s in steps of %d",
-                             smap.fname, conf.anneal_steps)
-                packed = PackedBoxes(sprites, anneal_steps=conf.anneal_steps)
-                print_packed_size(packed)
-                sm_plcs.append((smap, packed.placements))
-                im = stitch(packed)
+            layout_fn = warm = None
+            if conf.warm_start:
+                layout_fn = conf.get_layout_out(smap.fname)
+                warm = _warm_packing(sprites, layout_fn, conf)
+
+            if warm is not None:
+                w_ln("reusing layout from %s" % (layout_fn,))
+                packer = "warm"
+                parts = [(warm, list(warm), warm.render())]
+            else:
+                packer = conf.packer
+                if conf.packer == 'annealing':
+                    logger.debug("annealing %s in steps of %d",
+                                 smap.fname, conf.anneal_steps)
+                pack = lambda s, max_size: _pack_sprites(s, conf, cache,
+                                                         max_size)
+                parts = split_packing(sprites, pack, max_size=conf.max_size)
+                if len(parts) > 1:
+                    w_ln("splitting %s into %d spritemaps" %
+                         (smap.fname, len(parts)))
+
+            for n, (packed, placements, im) in enumerate(parts, 1):
+                if len(parts) == 1:
+                    fname = smap.fname
+                else:
+                    fname = conf.get_spritemap_part_out(smap.fname, n)
+                part = SpriteMap(fname, [b.fname for (p, b) in placements],
+                                 origin=smap.origin)
+
+                print_packed_size(packed, out=out)
+                if stats_out is not None:
+                    dump_packing_stats(packed, out=stats_out,
+                                       spritemap=fname,
+                                       packer=packer)
 
-            elif conf.packer == 'naive':
-                im, placements = naive_packing(sprites)
-                sm_plcs.append((smap, placements))
+                sm_plcs.append((part, placements))
+                if encoders:
+                    im.reusable()
 
-            w_ln("writing spritemap image at %s" % (smap.fname,))
-            with open(smap.fname, "wb") as fp:
-                im.save(fp)
+                w_ln("writing spritemap image at %s" % (fname,))
+                changed = _save_image(im, fname, conf)
+                if not changed:
+                    w_ln(" - pixels unchanged, left as is")
+
+                alts = []
+                for encoder in encoders:
+                    alt_fn = conf.get_spritemap_format_out(fname,
+                                                           encoder.extension)
+                    if changed or not access(alt_fn, R_OK):
+                        w_ln("writing spritemap image at %s" % (alt_fn,))
+                        with open(alt_fn, "wb") as fp:
+                            encoder.encode(im, fp)
+                    alts.append((hashed_out(alt_fn, conf),
+                                 encoder.mime_type))
+
+                part.fname = hashed_out(fname, conf)
+                if alts:
+                    part.alternatives = alts + [(part.fname, "image/png")]
+
+                if conf.retina:
+                    size = (im.width, im.height)
+                    retina_fn = _write_retina(fname, placements, size, conf)
+                    if retina_fn:
+                        w_ln("wrote @2x spritemap image at %s" % (retina_fn,))
+                        part.retina = (hashed_out(retina_fn, conf), size)
+
+            # a layout of several maps can't be a starting point for one
+            if layout_fn and len(parts) == 1:
+                (packed, placements, im) = parts[0]
+                write_layout(layout_fn, placements, size=(im.width, im.height))
 
     replacer = SpriteReplacer(sm_plcs)
     for css in css_fs:
         w_ln("writing new css at %s" % (css.output_fname,))
-        with open(css.output_fname, "wb") as fp:
-            print_css(replacer(css), out=fp)
+        map_fn = _write_css(css, replacer)
+        if map_fn:
+            w_ln("wrote source map at %s" % (map_fn,))
 
 op = optparse.OptionParser()
-op.set_usage("%prog [opts] <css file(s) ...>")
+op.set_usage("%prog [opts] <css file(s) ...>\n\n"
+             "A css file of - is read from standard input, and its rewritten "
+             "css written to standard output.")
 op.add_option("-c", "--conf", metavar="INI",
               help="read base configuration from INI")
 op.add_option("--padding", type=int, metavar="N",
               help="keep N pixels of padding between sprites")
+op.add_option("--cache-dir", metavar="DIR",
+              help="reuse packing results stored in DIR")
+op.add_option("--stats", metavar="FILE",
+              help="write packing statistics to FILE as JSON lines")
 op.add_option("-v", "--verbose", action="store_true",
               help="use debug logging level")
 #op.add_option("--in-memory", action="store_true",
@@ -147,11 +438,27 @@ def main():
         base["anneal_steps"] = opts.anneal
     if opts.padding:
         base["padding"] = (opts.padding, opts.padding)
+    if opts.cache_dir:
+        base["cache_dir"] = path.abspath(opts.cache_dir)
     if opts.no_optimization:
         base["anneal_steps"] = 100
 
+    if args.count("-") > 1:
+        op.error("standard input can only be read once")
+
     conf = CSSConfig(base=base)
-    spritemap([css_cls.open_file(fn, conf=conf) for fn in args], conf=conf)
+    css_fs = []
+    for fn in args:
+        if fn == "-":
+            css_fs.append(StreamCSSFile.open_stream(sys.stdin, sys.stdout,
+                                                    conf=conf))
+        else:
+            css_fs.append(css_cls.open_file(fn, conf=conf))
+    if opts.stats:
+        with open(opts.stats, "w") as stats_out:
+            spritemap(css_fs, conf=conf, stats_out=stats_out)
+    else:
+        spritemap(css_fs, conf=conf)
 
 if __name__ == "__main__":
     main()
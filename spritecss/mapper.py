@@ -6,6 +6,10 @@ from spritecss.config import CSSConfig
 logger = logging.getLogger(__name__)
 
 class BaseMapper(object):
+    """Maps sprite references to spritemap names. Sprites in the same
+    directory always map to the same spritemap.
+    """
+
     def __call__(self, sprite):
         try:
             dn = self._map_sprite_ref(sprite)
@@ -20,13 +24,18 @@ class BaseMapper(object):
     def map_reduced(self, srefs):
         "Sort *srefs* into dict with a lists of sprites for each spritemap."""
         smaps = {}
+        # each directory is mapped only once
+        dir_smaps = {}
         for sref in srefs:
-            fname = self(sref)
-            smap = smaps.get(fname)
+            dn = path.dirname(str(sref))
+            smap = dir_smaps.get(dn)
             if smap is None:
-                smap = smaps[fname] = SpriteMap(fname)
-            if sref not in smap:
-                smap.append(sref)
+                fname = self(sref)
+                smap = smaps.get(fname)
+                if smap is None:
+                    smap = smaps[fname] = SpriteMap(fname)
+                dir_smaps[dn] = smap
+            smap.append(sref)
         return smaps
 
 class OutputImageMapper(BaseMapper):
@@ -44,6 +53,36 @@ class OutputImageMapper(BaseMapper):
     def _map_sprite_ref(self, sref):
         return self.fname
 
+def _build_dir_trie(dirs):
+    """Make a trie of the components of paths *dirs*, where the None key of
+    a node holds the directory ending there.
+    """
+    trie = {}
+    for dn in dirs:
+        node = trie
+        for part in dn.split(path.sep):
+            node = node.setdefault(part, {})
+        node.setdefault(None, dn)
+    return trie
+
+def _find_dir(trie, dn):
+    """Find the deepest directory in *trie* that path *dn* is within, giving
+    it and the list of the components of *dn* below it. Raises LookupError if
+    there is none.
+    """
+    parts = dn.split(path.sep)
+    (found, depth) = (None, 0)
+    node = trie
+    for (n, part) in enumerate(parts):
+        node = node.get(part)
+        if node is None:
+            break
+        if None in node:
+            (found, depth) = (node[None], n + 1)
+    if found is None:
+        raise LookupError(dn)
+    return (found, parts[depth:])
+
 class SpriteDirsMapper(BaseMapper):
     """Maps sprites to spritemaps by using the sprite directory."""
 
@@ -53,6 +92,7 @@ class SpriteDirsMapper(BaseMapper):
         self.sprite_dirs = sprite_dirs
         self.recursive = recursive
         self.translate = translate
+        self._trie = _build_dir_trie(sprite_dirs or ())
 
     @classmethod
     def from_conf(cls, conf):
@@ -64,16 +104,58 @@ class SpriteDirsMapper(BaseMapper):
         if self.sprite_dirs is None:
             return path.dirname(sref.fname)
 
-        for sdir in self.sprite_dirs:
-            prefix = path.commonprefix((sdir, path.dirname(str(sref))))
-            if prefix == sdir:
-                if self.recursive:
-                    submap = path.dirname(path.relpath(str(sref), sdir))
-                    if submap:
-                        return path.join(sdir, submap)
-                return sdir
-
-        raise LookupError
+        dn = path.dirname(str(sref))
+        (sdir, rest) = _find_dir(self._trie, dn)
+        if self.recursive and rest:
+            return path.join(sdir, *rest)
+        return sdir
+
+def _sprite_weight(sref):
+    """Weight of a sprite in bytes to transfer, going by its file size."""
+    try:
+        return path.getsize(str(sref))
+    except OSError:
+        return 0
+
+def cluster_by_usage(srefs, sources, request_cost=2048, weight=_sprite_weight):
+    """Partition *srefs* into groups so as to minimize bytes transferred per
+    page. *sources* is a dict of sprite fname => set of CSS sources using it.
+
+    Each CSS source stands for a page, which costs the weight of every group
+    it uses plus *request_cost* per group. Sprites used by the same set of
+    sources start out together, then the two groups whose merging lowers the
+    total cost the most are merged until no merge helps.
+    """
+    clusters = []
+    by_users = {}
+    for sref in srefs:
+        users = frozenset(sources.get(sref.fname, ()))
+        if users not in by_users:
+            by_users[users] = len(clusters)
+            clusters.append((users, 0, []))
+        idx = by_users[users]
+        (users, total, members) = clusters[idx]
+        members.append(sref)
+        clusters[idx] = (users, total + weight(sref), members)
+
+    def merge_gain(a, b):
+        ((users_a, weight_a, _), (users_b, weight_b, _)) = (a, b)
+        return (len(users_a & users_b) * request_cost
+                - len(users_a - users_b) * weight_b
+                - len(users_b - users_a) * weight_a)
+
+    while len(clusters) > 1:
+        (gain, i, j) = max((merge_gain(a, clusters[j]), i, j)
+                           for (i, a) in enumerate(clusters)
+                           for j in xrange(i + 1, len(clusters)))
+        if gain <= 0:
+            break
+        (users_b, weight_b, members_b) = clusters.pop(j)
+        (users_a, weight_a, members_a) = clusters[i]
+        clusters[i] = (users_a | users_b, weight_a + weight_b,
+                       members_a + members_b)
+
+    return [m for (_, _, m) in clusters]
 
 def mapper_from_conf(conf):
     if conf.output_image:
@@ -91,6 +173,8 @@ class SpriteMapCollector(object):
             conf = CSSConfig()
         self.conf = conf
         self._maps = {}
+        #: sprite fname => set of CSS sources referencing it
+        self.sources = {}
 
     def __iter__(self):
         return (self._maps[k] for k in self._maps if k is not None)
@@ -101,21 +185,37 @@ class SpriteMapCollector(object):
 
     def collect(self, smaps):
         for fname, smap in smaps.iteritems():
+            for sref in smap:
+                self.sources.setdefault(sref.fname, set()).add(sref.source)
             if fname in self._maps:
+                # several sources may use the same sprites
                 self._maps[fname].extend(smap)
             else:
                 self._maps[fname] = SpriteMap(fname, smap)
 
         return [self._maps[k] for k in smaps if k is not None]
 
+    def iter_usage_split(self, request_cost=2048):
+        """Split each spritemap into parts of sprites that are used together,
+        see `cluster_by_usage`. Parts keep the spritemap as their origin.
+        """
+        for smap in self:
+            groups = cluster_by_usage(smap, self.sources,
+                                      request_cost=request_cost)
+            if len(groups) == 1:
+                yield smap
+                continue
+            for n, group in enumerate(groups, 1):
+                fname = self.conf.get_spritemap_part_out(smap.fname, n)
+                yield SpriteMap(fname, group, origin=smap.origin)
+
     def map_file(self, fname, mapper=None):
         """Convenience function to map the sprites of a given CSS file."""
-        from spritecss.css import CSSParser
+        from spritecss.css import scan_css
         from spritecss.finder import find_sprite_refs
 
         with open(fname, "rb") as fp:
-            parser = CSSParser.read_file(fp)
-            evs = list(parser.iter_events())
+            evs = list(scan_css(fp.read()))
 
         conf = CSSConfig(evs, base=self.conf, fname=fname)
         srefs = find_sprite_refs(evs, source=fname, conf=conf)
@@ -18,8 +18,11 @@ algorithm, as follows:
    space into two child rectangles
 """
 
+import time
+import json
 import random
 from .anneal import Annealer
+from .cache import packing_key
 
 class Rect(object):
     def __init__(self, rect=None, x1=None, y1=None, x2=None, y2=None):
@@ -142,12 +145,14 @@ class OpaqueBoxNode(BoxNode):
         raise NoRoom("opaque box node")
 
 class PackingAnnealer(Annealer):
-    def __init__(self, boxes):
+    def __init__(self, boxes, max_size=None):
         # self.move, self.energy need not be set: the class methods are fine.
         self.boxes = boxes
         self.optimal_size = sum(b.outer_area for b in boxes)
         self.max_size = (sum(b.outer_width for b in boxes),
                          sum(b.outer_height for b in boxes))
+        if max_size:
+            self.max_size = tuple(map(min, self.max_size, max_size))
 
     def move(self, state):
         a, b = random.sample(xrange(len(state)), 2)
@@ -158,19 +163,36 @@ class PackingAnnealer(Annealer):
         w = h = 0
         # TODO Don't require arbitrarily sized box node for root
         tree = BoxNode.from_size(self.max_size)
+        self._last_state = list(state)
+        unplaced = 0
         for idx in state:
             box = self.boxes[idx]
-            node = tree.insert(box)
+            try:
+                node = tree.insert(box)
+            except NoRoom:
+                unplaced += 1
+                continue
             node.box = box
             placements.append((node.position, box))
             w = max(w, node.x2)
             h = max(h, node.y2)
         self._last_size = (w, h)
         self._last_tree = tree
-        return w * h
+        self._last_unplaced = unplaced
+        # Any state that places every box beats one that doesn't.
+        return w * h + unplaced * tree.area
 
     def anneal(self, *a, **k):
         state, e = Annealer.anneal(self, range(len(self.boxes)), *a, **k)
+        # The last state tried need not be the best one.
+        return self.replay(state)
+
+    def replay(self, state):
+        """Pack boxes in the order given by *state* without annealing."""
+        self.energy(state)
+        return self._crop()
+
+    def _crop(self):
         # Crops nodes to fit entire map exactly
         w, h = self._last_size
         def walk(n):
@@ -183,19 +205,97 @@ class PackingAnnealer(Annealer):
         walk(self._last_tree)
         return self._last_plcs, self._last_size
 
+def _strip_bound(lengths, depths, total_area):
+    """Lower bound on the area of any packing of boxes with outer *lengths*
+    along a strip of width W and *depths* across it, taken over all W.
+
+    Two boxes longer than W/2 can't sit side by side, so their depths must
+    add up.
+    """
+    boxes = sorted(zip(lengths, depths), reverse=True)
+    max_depth = max(depths)
+    total_length = sum(lengths)
+    # boxes[:wide] are the ones longer than W/2
+    wide = len(boxes)
+    wide_depth = sum(depths)
+    best = None
+    w = boxes[0][0]
+    # No packing is wider than all boxes in a row, and past that the bound
+    # is at least W * max_depth, which only grows.
+    while w <= total_length:
+        while wide and 2 * boxes[wide - 1][0] <= w:
+            wide -= 1
+            wide_depth -= boxes[wide][1]
+        min_depth = -(-total_area // w)
+        area = w * max(max_depth, wide_depth, min_depth)
+        if best is None or area < best:
+            best = area
+        # Until either the set of wide boxes or min_depth changes, the bound
+        # grows with W, so skip ahead to whichever changes first.
+        next_w = total_length + 1
+        if wide:
+            next_w = 2 * boxes[wide - 1][0]
+        if min_depth > 1:
+            next_w = min(next_w, -(-total_area // (min_depth - 1)))
+        if next_w * max_depth >= best:
+            break
+        w = next_w
+    return best
+
+def area_lower_bound(boxes):
+    """Compute a lower bound for the outer area of any packing of *boxes*."""
+    boxes = list(boxes)
+    if not boxes:
+        return 0
+    widths = [b.outer_width for b in boxes]
+    heights = [b.outer_height for b in boxes]
+    total = sum(w * h for (w, h) in zip(widths, heights))
+    return max(total,
+               _strip_bound(widths, heights, total),
+               _strip_bound(heights, widths, total))
+
 class PackedBoxes(object):
-    def __init__(self, boxes, pad=(0, 0), anneal_steps=9200):
+    def __init__(self, boxes, pad=(0, 0), anneal_steps=9200, cache=None,
+                 max_size=None):
         self.pad = pad
         self.anneal_steps = anneal_steps
+        self.cache = cache
+        self.max_size = max_size
         self._anneal(boxes)
         self.__iter__ = self.placements.__iter__
 
     def _anneal(self, boxes):
         boxes = list(boxes)
         # TODO Find out whether sorting by box area is really a smart move.
-        boxes.sort(key=lambda b: b.area)
-        p = PackingAnnealer(boxes)
-        (plcs, size) = p.anneal(800000, 1100, self.anneal_steps, 20)
+        # Ties are broken by outer size so cached states map back correctly.
+        boxes.sort(key=lambda b: (b.area, b.outer_size))
+        p = PackingAnnealer(boxes, max_size=self.max_size)
+        start = time.time()
+        self.lower_bound = area_lower_bound(boxes)
+        state = key = None
+        if self.cache is not None:
+            settings = {"anneal_steps": self.anneal_steps}
+            if self.max_size:
+                settings["max_size"] = list(self.max_size)
+            key = packing_key("annealing", boxes, **settings)
+            state = self.cache.get(key)
+        if state is None and len(boxes) < 2:
+            # nothing to anneal; moves need two boxes to swap
+            state = range(len(boxes))
+        if state is None:
+            (plcs, size) = p.anneal(800000, 1100, self.anneal_steps, 20,
+                                    target=self.lower_bound)
+            self.steps = p.steps_taken
+            if p._last_unplaced:
+                raise NoRoom("boxes do not fit in %dx%d" % self.max_size)
+            if key is not None:
+                self.cache.set(key, p._last_state)
+        else:
+            (plcs, size) = p.replay(state)
+            self.steps = 0
+            if p._last_unplaced:
+                raise NoRoom("boxes do not fit in %dx%d" % self.max_size)
+        self.elapsed = time.time() - start
         self.optimal_area = int(sum(b.outer_area for b in boxes))
         self.placements = plcs
         self.size = size
@@ -205,17 +305,41 @@ class PackedBoxes(object):
     def area(self):
         return Rect.from_size(self.size).area
 
+    #: the annealer's size includes the padding of the outermost boxes
+    outer_area = area
+
     @property
     def unused_area(self):
-        return self.area - self.optimal_area
+        return self.outer_area - self.optimal_area
 
     @property
     def unused_amount(self):
-        return float(self.unused_area) / self.area
+        return float(self.unused_area) / self.outer_area
 
 def print_packed_size(packed, out=None):
     args = (packed.size + (packed.unused_amount * 100,))
     print >>out, "Packed size is %dx%d (%.3f%% empty space)" % args
+    args = (packed.lower_bound, packed.outer_area, packed.steps,
+            packed.elapsed)
+    print >>out, ("Lower bound is %d of outer area %d, "
+                  "took %d steps in %.3fs" % args)
+
+def packing_stats(packed):
+    """Get a dict of statistics describing *packed*."""
+    return {"size": list(packed.size),
+            "area": packed.area,
+            "outer_area": packed.outer_area,
+            "optimal_area": packed.optimal_area,
+            "lower_bound": packed.lower_bound,
+            "unused_amount": packed.unused_amount,
+            "steps": packed.steps,
+            "elapsed": packed.elapsed}
+
+def dump_packing_stats(packed, out=None, **extra):
+    """Write statistics for *packed* to *out* as a line of JSON."""
+    stats = packing_stats(packed)
+    stats.update(extra)
+    print >>out, json.dumps(stats, sort_keys=True)
 
 def dump_placements(packed, out=None):
     for (pos, box) in packed.placements:
@@ -70,7 +70,7 @@ class Annealer:
         self.energy = energy  # function to calculate energy of a state
         self.move = move      # function to make a random change to a state
 
-    def anneal(self, state, Tmax, Tmin, steps, updates=0):
+    def anneal(self, state, Tmax, Tmin, steps, updates=0, target=None):
         """Minimizes the energy of a system by simulated annealing.
 
         Keyword arguments:
@@ -79,8 +79,10 @@ class Annealer:
         Tmin -- minimum temperature (must be greater than zero)
         steps -- the number of steps requested
         updates -- the number of updates to print during annealing
+        target -- stop early once a state with at most this energy is found
 
-        Returns the best state and energy found."""
+        Returns the best state and energy found.  The number of steps taken
+        is left in the steps_taken attribute."""
 
         step = 0
         start = time.time()
@@ -136,7 +138,8 @@ class Annealer:
             update(T, E, None, None)
 
         # Attempt moves to new states
-        while step < steps:
+        reached = lambda: target is not None and bestEnergy <= target
+        while step < steps and not reached():
             step += 1
             T = Tmax * math.exp( Tfactor * step / steps )
             self.move(state)
@@ -163,6 +166,7 @@ class Annealer:
                     trials, accepts, improves = 0, 0, 0
 
         # Return best state and energy
+        self.steps_taken = step
         return bestState, bestEnergy
 
     def auto(self, state, minutes, steps=2000):
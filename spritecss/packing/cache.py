@@ -0,0 +1,70 @@
+"""Persistent cache of packing results
+
+Packing only ever looks at the outer sizes of the sprites, so the result of
+packing a given multiset of sizes with a given packer can be reused across
+builds -- and machines -- regardless of which actual images are involved.
+
+Cache entries are JSON files in a directory, named by a digest of the key.
+"""
+
+import os
+import json
+import errno
+import hashlib
+import logging
+import tempfile
+from os import path
+
+logger = logging.getLogger(__name__)
+
+def canonical_order(boxes):
+    """Sort *boxes* so that boxes of equal outer size are interchangeable."""
+    return sorted(boxes, key=lambda b: b.outer_size)
+
+def packing_key(packer, boxes, **settings):
+    """Make a cache key for packing *boxes* using *packer*.
+
+    *boxes* must be in a canonical order, as stored values are positional.
+    """
+    return {"packer": packer,
+            "sizes": [list(b.outer_size) for b in boxes],
+            "padding": sorted(set(b.pad for b in boxes)),
+            "settings": settings}
+
+class PackingCache(object):
+    def __init__(self, dirname):
+        self.dirname = dirname
+
+    @classmethod
+    def from_conf(cls, conf):
+        if conf.cache_dir:
+            return cls(conf.cache_dir)
+
+    def _fname(self, key):
+        data = json.dumps(key, sort_keys=True)
+        return path.join(self.dirname, hashlib.sha1(data).hexdigest() + ".json")
+
+    def get(self, key):
+        """Look up *key*, returning None on a miss."""
+        fname = self._fname(key)
+        try:
+            with open(fname, "rb") as fp:
+                (stored_key, value) = json.load(fp)
+        except (IOError, ValueError):
+            return None
+        # Guard against digest collisions and stale formats.
+        if stored_key != json.loads(json.dumps(key)):
+            return None
+        logger.debug("packing cache hit: %s", fname)
+        return value
+
+    def set(self, key, value):
+        try:
+            os.makedirs(self.dirname)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        fd, tmp_fname = tempfile.mkstemp(dir=self.dirname, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fp:
+            json.dump([key, value], fp)
+        os.rename(tmp_fname, self._fname(key))
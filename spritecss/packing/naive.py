@@ -1,21 +1,26 @@
+import time
+import bisect
 import logging
+import operator
 import itertools
 
-from spritecss.image import Image
+from spritecss.stitch import paste
+from spritecss.packing import area_lower_bound, NoRoom
+from spritecss.packing.cache import canonical_order, packing_key
 
 logger = logging.getLogger('spritecss')
 
 
 class Packing(object):
-    def __init__(self, packing):
+    def __init__(self, packing, crop=True, size=None):
         placements, self.sprites = zip(*packing)
         self.input_area = sum(im.outer_width * im.outer_height
                               for im in self.sprites)
 
         # Offset such that top left image is (0, 0)
         xs, ys = zip(*placements)
-        top = min(ys)
-        left = min(xs)
+        top = min(ys) if crop else 0
+        left = min(xs) if crop else 0
         self.xs = [x - left for x in xs]
         self.ys = [y - top for y in ys]
 
@@ -23,106 +28,202 @@ class Packing(object):
                           for y, im in zip(self.ys, self.sprites))
         self.width = max(x + im.width
                          for x, im in zip(self.xs, self.sprites))
+        # a given size is kept unless the sprites reach beyond it
+        if size is not None:
+            self.width = max(self.width, size[0])
+            self.height = max(self.height, size[1])
         self.area = self.width * self.height
+        self.size = (self.width, self.height)
+        self.optimal_area = self.input_area
+
+        #: extent including the padding of the rightmost and bottommost
+        #: sprites, comparable to `area_lower_bound` and `optimal_area`
+        self.outer_width = max(self.width,
+                               max(x + im.outer_width
+                                   for x, im in zip(self.xs, self.sprites)))
+        self.outer_height = max(self.height,
+                                max(y + im.outer_height
+                                    for y, im in zip(self.ys, self.sprites)))
+        self.outer_area = self.outer_width * self.outer_height
+
+    @property
+    def unused_area(self):
+        return self.outer_area - self.optimal_area
+
+    @property
+    def unused_amount(self):
+        return float(self.unused_area) / self.outer_area
 
     def __iter__(self):
         return iter(zip(zip(self.xs, self.ys), self.sprites))
 
     def render(self):
-        meta = {"bitdepth": 8, "alpha": True}
-        rows = [bytearray((self.width * 4)) for i in range(self.height)]
-        for (x, y), sprite in self:
-            pixel_rows = sprite.im.pixels
-            for i, pixels in enumerate(pixel_rows):
-                row = rows[y + i]
-                a1 = x * 4
-                a2 = a1 + len(pixels)
-                row[a1:a2] = pixels
-        return Image(self.width, self.height, rows, meta)
+        return paste(self.size, ((pos, sprite.im) for (pos, sprite) in self))
 
 
 class SmallLengthReduction(object):
+    """Shelf packing: sprites are sorted by length and laid out in rows
+    along the depth axis, each row no deeper than a depth threshold.
+    Sprites up to a collapse threshold length are packed together as one
+    group; longer sprites get rows of their own length.
+
+    Every (collapse, depth) threshold pair is evaluated on arrays of the
+    sprite dimensions in sorted order, finding row breaks by bisecting the
+    prefix sums of depths. Only the winning layout is made into a Packing.
+    """
+
+    def __init__(self, target=None, max_size=None):
+        #: stop searching once a packing's outer area is at most this
+        self.target = target
+        #: largest (width, height) a packing may have, or None
+        self.max_size = max_size
+        self.steps = 0
+
+    def reached_target(self, packing):
+        return self.target is not None and packing.outer_area <= self.target
+
+    def _reached(self, outer_area):
+        return self.target is not None and outer_area <= self.target
+
     def pack(self, sprites):
-        sprites = sorted(sprites, key=self.get_length)
-        by_length_iter = itertools.groupby(sprites, key=self.get_length)
-        by_length = [(k, list(vs)) for k, vs in by_length_iter]
-
-        packings = []
-        for i in range(len(by_length)):
-            collapsed = []
-            for j in range(i + 1):
-                collapsed += by_length[j][1]
-            collapsed_by_length = ([(by_length[i][0], collapsed)] +
-                                   by_length[i + 1:])
-            packing = self.pack_rows(collapsed_by_length)
+        sprites = self.sprites = sorted(sprites, key=self.get_length)
+        self.lengths = [self.get_length(im) for im in sprites]
+        self.inner_lengths = [self.get_inner_length(im) for im in sprites]
+        self.depths = [self.get_depth(im) for im in sprites]
+        self.inner_depths = [self.get_inner_depth(im) for im in sprites]
+        self.prefix = [0]
+        for depth in self.depths:
+            self.prefix.append(self.prefix[-1] + depth)
+        self.pad_length = max(itertools.imap(operator.sub, self.lengths,
+                                             self.inner_lengths))
+        self.pad_depth = max(itertools.imap(operator.sub, self.depths,
+                                            self.inner_depths))
+
+        # end index of each run of equal lengths
+        n = len(sprites)
+        ends = [i for i in xrange(1, n)
+                if self.lengths[i] != self.lengths[i - 1]] + [n]
+
+        if self.max_size is None:
+            self.max_depth = self.max_length = None
+        else:
+            max_w, max_h = self.max_size
+            (self.max_depth, self.max_length) = \
+                    self.placement_tuple(depth=max_w, length=max_h)
+
+        best = best_segments = None
+        for i, end in enumerate(ends):
+            segments = [(0, end)] + zip(ends[i:], ends[i + 1:])
+            cand = self.pack_rows(segments)
+            if cand is None:
+                logger.debug("Collapse all smaller than %s => no fit",
+                             self.lengths[end - 1])
+                continue
             logger.debug("Collapse all smaller than %s => %s",
-                         by_length[i][0], packing.area)
-            packings.append(packing)
-        best = min(packings, key=self.get_packing_area)
-        logger.info("small_length_reduction: Best is area %s", best.area)
-        return best
-
-    def bins_for_depth(self, by_length, depth):
-        bins = []
-        for length, ims in by_length:
-            row = None
-            rows = []
-            row_depth = depth
-            for im in ims:
-                if row_depth + self.get_depth(im) > depth:
-                    row = []
-                    rows.append(row)
-                    row_depth = 0
-                row.append(im)
-                row_depth += self.get_depth(im)
-            bins.append((length, rows))
-        return bins
-
-    def packing_for_depth(self, by_length, depth):
-        bins = self.bins_for_depth(by_length, depth)
-        packing = []
-        y = 0
-        for length, rows in bins:
-            for row in rows:
-                x = 0
-                max_length = 0
-                for im in row:
-                    placement = self.placement_tuple(depth=x, length=y)
-                    packing.append((placement, im))
-                    max_length = max(max_length, self.get_length(im))
-                    x += self.get_depth(im)
-                y += max_length
-        return Packing(packing)
-
-    def pack_rows(self, by_length):
-        min_depth = max(self.get_depth(im)
-                        for l, ims in by_length for im in ims)
-        max_depth = max(sum(self.get_depth(im) for im in ims)
-                        for l, ims in by_length)
+                         self.lengths[end - 1], cand[0])
+            if best is None or cand[0] < best[0]:
+                (best, best_segments) = (cand, segments)
+            if self._reached(cand[2]):
+                break
+
+        if best is None:
+            raise NoRoom("sprites do not fit in %dx%d" % self.max_size)
+
+        packing = Packing(self.placements(best_segments, best[1]))
+        logger.info("small_length_reduction: Best is area %s", packing.area)
+        return packing
+
+    def iter_rows(self, segments, depth):
+        """Yield (start, end, offset) of each row when packing *segments*
+        of the sorted sprites in rows no deeper than *depth*.
+        """
+        prefix = self.prefix
+        offset = 0
+        for (a, b) in segments:
+            while a < b:
+                e = bisect.bisect_right(prefix, prefix[a] + depth,
+                                        a + 1, b + 1) - 1
+                yield (a, e, offset)
+                # sorted by length, so the last sprite is the longest
+                offset += self.lengths[e - 1]
+                a = e
+
+    def extents(self, segments, depth):
+        """Compute the (depth, length) extents of the packing *segments* in
+        rows no deeper than *depth*, as `Packing` would crop it.
+        """
+        prefix = self.prefix
+        inner_depths = self.inner_depths
+        depth_ext = 0
+        for (a, e, offset) in self.iter_rows(segments, depth):
+            row_depth = prefix[e - 1] - prefix[a] + inner_depths[e - 1]
+            if row_depth > depth_ext:
+                depth_ext = row_depth
+        # rows advance by their outer length, so the last row is the end
+        length_ext = offset + max(self.inner_lengths[a:e])
+        return (depth_ext, length_ext)
+
+    def placements(self, segments, depth):
+        prefix = self.prefix
+        sprites = self.sprites
+        rv = []
+        for (a, e, offset) in self.iter_rows(segments, depth):
+            for i in xrange(a, e):
+                pos = self.placement_tuple(depth=prefix[i] - prefix[a],
+                                           length=offset)
+                rv.append((pos, sprites[i]))
+        return rv
+
+    def pack_rows(self, segments):
+        """Find the best depth threshold for packing *segments*, giving
+        (area, depth, outer area), or None if nothing fits `max_size`.
+        """
+        prefix = self.prefix
+        min_depth = max(self.depths)
+        max_depth = max(prefix[b] - prefix[a] for (a, b) in segments)
+        if self.max_depth is not None:
+            # rows are cropped to their inner depth, so padding may exceed
+            max_depth = min(max_depth, self.max_depth + self.pad_depth)
 
         depth = max_depth
-        packings = []
+        best = None
+        tried = 0
         while depth >= min_depth:
-            p = self.packing_for_depth(by_length, depth)
-            depth = self.get_packing_depth(p) - 1
-            packings.append(p)
-        best = min(packings, key=self.get_packing_area)
+            threshold = depth
+            (depth_ext, length_ext) = self.extents(segments, threshold)
+            tried += 1
+            self.steps += 1
+            depth = depth_ext - 1
+            if not self.fits(depth_ext, length_ext):
+                continue
+            area = depth_ext * length_ext
+            outer_area = ((depth_ext + self.pad_depth) *
+                          (length_ext + self.pad_length))
+            if best is None or area < best[0]:
+                best = (area, threshold, outer_area)
+            if self._reached(outer_area):
+                break
         logger.debug(
             "%s: Tried %s depth thresholds between %s and %s; best is %s",
-            type(self).__name__, len(packings), min_depth, max_depth,
-            self.get_packing_depth(best))
+            type(self).__name__, tried, min_depth, max_depth,
+            best and best[1])
         return best
 
+    def fits(self, depth_ext, length_ext):
+        if self.max_size is None:
+            return True
+        return depth_ext <= self.max_depth and length_ext <= self.max_length
+
     def get_length(self, im):
         raise NotImplementedError
 
-    def get_depth(self, im):
+    def get_inner_length(self, im):
         raise NotImplementedError
 
-    def get_packing_area(self, packing):
-        return packing.area
+    def get_depth(self, im):
+        raise NotImplementedError
 
-    def get_packing_depth(self, packing):
+    def get_inner_depth(self, im):
         raise NotImplementedError
 
     def placement_tuple(self, depth, length):
@@ -133,11 +234,14 @@ class SmallHeightReduction(SmallLengthReduction):
     def get_length(self, im):
         return im.outer_height
 
+    def get_inner_length(self, im):
+        return im.height
+
     def get_depth(self, im):
         return im.outer_width
 
-    def get_packing_depth(self, packing):
-        return packing.width
+    def get_inner_depth(self, im):
+        return im.width
 
     def placement_tuple(self, depth, length):
         return (depth, length)
@@ -147,26 +251,80 @@ class SmallWidthReduction(SmallLengthReduction):
     def get_length(self, im):
         return im.outer_width
 
+    def get_inner_length(self, im):
+        return im.width
+
     def get_depth(self, im):
         return im.outer_height
 
-    def get_packing_depth(self, packing):
-        return packing.height
+    def get_inner_depth(self, im):
+        return im.height
 
     def placement_tuple(self, depth, length):
         return (length, depth)
 
 
-def naive_packing(sprites):
-    p1 = SmallHeightReduction().pack(sprites)
-    p2 = SmallWidthReduction().pack(sprites)
-    packing = p1 if p1.area <= p2.area else p2
-    image_area = sum(sprite.outer_width * sprite.outer_height
-                     for sprite in sprites)
-    whitespace = packing.area - image_area
-    whitespace_fraction = 1.0 * whitespace / packing.area
+def _pack(sprites, target=None, max_size=None):
+    packing = None
+    steps = 0
+    for cls in (SmallHeightReduction, SmallWidthReduction):
+        reducer = cls(target=target, max_size=max_size)
+        try:
+            p = reducer.pack(sprites)
+        except NoRoom:
+            continue
+        finally:
+            steps += reducer.steps
+        if packing is None or p.area < packing.area:
+            packing = p
+        if reducer.reached_target(packing):
+            break
+    if packing is None:
+        raise NoRoom("sprites do not fit in %dx%d" % max_size)
+    packing.steps = steps
+    return packing
+
+
+def _cached_pack(sprites, cache, target=None, max_size=None):
+    ordered = canonical_order(sprites)
+    if max_size is None:
+        key = packing_key("naive", ordered)
+    else:
+        key = packing_key("naive", ordered, max_size=list(max_size))
+    positions = cache.get(key)
+    if positions is not None:
+        packing = Packing(zip(map(tuple, positions), ordered))
+        packing.steps = 0
+        return packing
+    packing = _pack(sprites, target=target, max_size=max_size)
+    by_sprite = dict((id(im), pos) for (pos, im) in packing)
+    cache.set(key, [by_sprite[id(im)] for im in ordered])
+    return packing
+
+
+def naive_pack(sprites, cache=None, max_size=None):
+    """Pack *sprites* into a `Packing`, which also carries the lower bound,
+    steps and time taken like `PackedBoxes` does.
+
+    If *max_size* is given, raises NoRoom unless the sprites fit within it.
+    """
+    start = time.time()
+    bound = area_lower_bound(sprites)
+    if cache is None:
+        packing = _pack(sprites, target=bound, max_size=max_size)
+    else:
+        packing = _cached_pack(sprites, cache, target=bound,
+                               max_size=max_size)
+    packing.lower_bound = bound
+    packing.elapsed = time.time() - start
     logger.info("naive_packing: %d/%d: %.2f%% whitespace",
-                image_area, packing.area, 100 * whitespace_fraction)
+                packing.optimal_area, packing.outer_area,
+                100 * packing.unused_amount)
+    return packing
+
+
+def naive_packing(sprites, cache=None):
+    packing = naive_pack(sprites, cache=cache)
     im = packing.render()
     return im, list(packing)
 
@@ -0,0 +1,64 @@
+"""Splitting of sprites into several size-limited spritemaps
+
+Browsers, mobile ones in particular, handle huge images poorly. When a set of
+sprites doesn't fit within the maximum size, it is split in two groups of
+roughly equal area -- keeping similarly sized sprites together -- and each
+group is packed on its own, recursively.
+"""
+
+import logging
+
+from . import NoRoom, area_lower_bound
+
+logger = logging.getLogger(__name__)
+
+def _fits(sprite, max_size):
+    return (sprite.outer_width <= max_size[0] and
+            sprite.outer_height <= max_size[1])
+
+def _bisect_by_area(sprites):
+    sprites = sorted(sprites, key=lambda s: s.outer_size, reverse=True)
+    half = sum(s.outer_area for s in sprites) / 2.0
+    area = 0
+    for idx, sprite in enumerate(sprites):
+        area += sprite.outer_area
+        if area >= half:
+            break
+    idx = max(1, min(idx, len(sprites) - 1))
+    return (sprites[:idx], sprites[idx:])
+
+def split_packing(sprites, pack, max_size=None):
+    """Pack *sprites* using *pack*, a callable taking a list of sprites and a
+    maximum size, splitting them into as many groups as needed for each to
+    fit *max_size*.
+
+    Returns a list of whatever *pack* returns, one for each group.
+    """
+    sprites = list(sprites)
+    if not max_size:
+        return [pack(sprites, None)]
+
+    oversized = [s for s in sprites if not _fits(s, max_size)]
+    for sprite in oversized:
+        logger.warn("%s: larger than maximum spritemap size %dx%d",
+                    sprite.fname, max_size[0], max_size[1])
+    sprites = [s for s in sprites if _fits(s, max_size)]
+
+    rv = [pack([s], None) for s in oversized]
+    if sprites:
+        rv.extend(_split_packing(sprites, pack, max_size))
+    return rv
+
+def _split_packing(sprites, pack, max_size):
+    if len(sprites) == 1 or \
+            area_lower_bound(sprites) <= max_size[0] * max_size[1]:
+        try:
+            return [pack(sprites, max_size)]
+        except NoRoom:
+            # a single sprite always fits, so this never recurses forever
+            pass
+    (a, b) = _bisect_by_area(sprites)
+    logger.debug("splitting %d sprites into groups of %d and %d",
+                 len(sprites), len(a), len(b))
+    return _split_packing(a, pack, max_size) + \
+           _split_packing(b, pack, max_size)
@@ -0,0 +1,119 @@
+"""Warm-start packing from a previous build's layout
+
+Repacking from scratch whenever a sprite is added moves every other sprite
+too, so every background offset in the generated CSS changes. Instead, keep
+sprites that are still present (and still the same size) where they were, and
+put the new ones into free space around them.
+
+Layouts are stored in the format of `dump_placements`, except that sprite
+file names are relative to the layout file. A first line of ``size,W,H``
+gives the size the spritemap was written at, which a warm start keeps so an
+unchanged spritemap comes out the same.
+"""
+
+import time
+import logging
+from os import path
+
+from . import area_lower_bound
+from .naive import Packing
+
+logger = logging.getLogger(__name__)
+
+class Layout(dict):
+    """Dict of sprite fname => box, from a layout file."""
+
+    #: (width, height) of the spritemap, if known
+    size = None
+
+def read_layout(fname):
+    """Read a layout file into a `Layout`."""
+    base = path.dirname(fname)
+    layout = Layout()
+    with open(fname, "rb") as fp:
+        for line in fp:
+            line = line.strip()
+            if not line:
+                continue
+            parts = line.rsplit(",", 4)
+            if len(parts) == 3 and parts[0] == "size":
+                layout.size = tuple(map(int, parts[1:]))
+                continue
+            sprite_fn = path.normpath(path.join(base, parts[0]))
+            layout[sprite_fn] = tuple(map(int, parts[1:]))
+    return layout
+
+def write_layout(fname, placements, size=None):
+    base = path.dirname(fname)
+    with open(fname, "wb") as fp:
+        if size is not None:
+            fp.write("size,{0},{1}\n".format(*size))
+        for (pos, box) in placements:
+            box_desc = ",".join(map(str, box.calc_box(pos)))
+            sprite_fn = path.relpath(str(box.fname), base or path.curdir)
+            fp.write("{0},{1}\n".format(sprite_fn, box_desc))
+
+def _overlaps(a, b):
+    return not (a[2] <= b[0] or b[2] <= a[0] or
+                a[3] <= b[1] or b[3] <= a[1])
+
+def _outer_box(pos, sprite):
+    (x, y) = pos
+    return (x, y, x + sprite.outer_width, y + sprite.outer_height)
+
+def _find_free_spot(sprite, boxes, size):
+    """Find the position for *sprite* among the occupied *boxes* that grows
+    the bounding *size* the least.
+    """
+    (w, h) = size
+    cands = set([(0, 0)])
+    for (x1, y1, x2, y2) in boxes:
+        cands.update(((x2, y1), (x1, y2), (x2, 0), (0, y2)))
+    def cost(pos):
+        (x, y) = pos
+        new_w = max(w, x + sprite.outer_width)
+        new_h = max(h, y + sprite.outer_height)
+        return (new_w * new_h, y, x)
+    for pos in sorted(cands, key=cost):
+        box = _outer_box(pos, sprite)
+        if not any(_overlaps(box, other) for other in boxes):
+            return pos
+
+def warm_packing(sprites, layout, max_waste=0.25):
+    """Pack *sprites* keeping the positions given by *layout*.
+
+    Returns a Packing, or None if the result would waste more than
+    *max_waste* of its area, in which case a full repack is in order.
+    """
+    start = time.time()
+    kept, new = [], []
+    for sprite in sprites:
+        prev = layout.get(path.normpath(str(sprite.fname)))
+        if prev and prev[2:] == sprite.calc_box(prev[:2])[2:]:
+            kept.append((prev[:2], sprite))
+        else:
+            new.append(sprite)
+
+    if not kept:
+        return None
+
+    boxes = [_outer_box(pos, sprite) for (pos, sprite) in kept]
+    size = (max(b[2] for b in boxes), max(b[3] for b in boxes))
+    new.sort(key=lambda s: s.outer_area, reverse=True)
+    for sprite in new:
+        pos = _find_free_spot(sprite, boxes, size)
+        box = _outer_box(pos, sprite)
+        boxes.append(box)
+        kept.append((pos, sprite))
+        size = (max(size[0], box[2]), max(size[1], box[3]))
+
+    packing = Packing(kept, crop=False, size=getattr(layout, "size", None))
+    waste = packing.unused_amount
+    logger.info("warm_packing: kept %d, inserted %d: %.2f%% whitespace",
+                len(kept) - len(new), len(new), 100 * waste)
+    if waste > max_waste:
+        return None
+    packing.lower_bound = area_lower_bound(sprites)
+    packing.steps = 0
+    packing.elapsed = time.time() - start
+    return packing
@@ -172,6 +172,7 @@ try: # See :pyver:old
     import itertools
 except:
     pass
+import binascii
 import math
 # http://www.python.org/doc/2.4.4/lib/module-operator.html
 import operator
@@ -208,6 +209,26 @@ def group(s, n):
     # http://www.python.org/doc/2.6/library/functions.html#zip
     return zip(*[iter(s)]*n)
 
+_sample_tables = {}
+
+def sample_table(bitdepth):
+    """Lookup table from each possible byte of packed `bitdepth`-bit
+    samples (`bitdepth` < 8) to the string of those samples, one per
+    byte.  Used to unpack rows with a single ``join``.
+    """
+
+    try:
+        return _sample_tables[bitdepth]
+    except KeyError:
+        pass
+    spb = 8//bitdepth
+    mask = 2**bitdepth - 1
+    shifts = [bitdepth*i for i in reversed(range(spb))]
+    table = [struct.pack('%dB' % spb, *[mask&(o>>i) for i in shifts])
+             for o in range(256)]
+    _sample_tables[bitdepth] = table
+    return table
+
 def isarray(x):
     """Same as ``isinstance(x, array)`` except on Python 2.2, where it
     always returns ``False``.  This helps PyPNG work on Python 2.2.
@@ -668,57 +689,7 @@ class Writer:
 
         """
 
-        # http://www.w3.org/TR/PNG/#5PNG-file-signature
-        outfile.write(_signature)
-
-        # http://www.w3.org/TR/PNG/#11IHDR
-        write_chunk(outfile, 'IHDR',
-                    struct.pack("!2I5B", self.width, self.height,
-                                self.bitdepth, self.color_type,
-                                0, 0, self.interlace))
-
-        # See :chunk:order
-        # http://www.w3.org/TR/PNG/#11gAMA
-        if self.gamma is not None:
-            write_chunk(outfile, 'gAMA',
-                        struct.pack("!L", int(round(self.gamma*1e5))))
-
-        # See :chunk:order
-        # http://www.w3.org/TR/PNG/#11sBIT
-        if self.rescale:
-            write_chunk(outfile, 'sBIT',
-                struct.pack('%dB' % self.planes,
-                            *[self.rescale[0]]*self.planes))
-        
-        # :chunk:order: Without a palette (PLTE chunk), ordering is
-        # relatively relaxed.  With one, gAMA chunk must precede PLTE
-        # chunk which must precede tRNS and bKGD.
-        # See http://www.w3.org/TR/PNG/#5ChunkOrdering
-        if self.palette:
-            p,t = self.make_palette()
-            write_chunk(outfile, 'PLTE', p)
-            if t:
-                # tRNS chunk is optional.  Only needed if palette entries
-                # have alpha.
-                write_chunk(outfile, 'tRNS', t)
-
-        # http://www.w3.org/TR/PNG/#11tRNS
-        if self.transparent is not None:
-            if self.greyscale:
-                write_chunk(outfile, 'tRNS',
-                            struct.pack("!1H", *self.transparent))
-            else:
-                write_chunk(outfile, 'tRNS',
-                            struct.pack("!3H", *self.transparent))
-
-        # http://www.w3.org/TR/PNG/#11bKGD
-        if self.background is not None:
-            if self.greyscale:
-                write_chunk(outfile, 'bKGD',
-                            struct.pack("!1H", *self.background))
-            else:
-                write_chunk(outfile, 'bKGD',
-                            struct.pack("!3H", *self.background))
+        self.write_preamble(outfile)
 
         # http://www.w3.org/TR/PNG/#11IDAT
         if self.compression is not None:
@@ -819,6 +790,76 @@ class Writer:
         write_chunk(outfile, 'IEND')
         return i+1
 
+    def write_preamble(self, outfile):
+        """
+        Write the PNG signature and every chunk that precedes the
+        ``IDAT`` chunks to the output file.
+        """
+
+        # http://www.w3.org/TR/PNG/#5PNG-file-signature
+        outfile.write(_signature)
+
+        # http://www.w3.org/TR/PNG/#11IHDR
+        write_chunk(outfile, 'IHDR',
+                    struct.pack("!2I5B", self.width, self.height,
+                                self.bitdepth, self.color_type,
+                                0, 0, self.interlace))
+
+        # See :chunk:order
+        # http://www.w3.org/TR/PNG/#11gAMA
+        if self.gamma is not None:
+            write_chunk(outfile, 'gAMA',
+                        struct.pack("!L", int(round(self.gamma*1e5))))
+
+        # See :chunk:order
+        # http://www.w3.org/TR/PNG/#11sBIT
+        if self.rescale:
+            write_chunk(outfile, 'sBIT',
+                struct.pack('%dB' % self.planes,
+                            *[self.rescale[0]]*self.planes))
+        
+        # :chunk:order: Without a palette (PLTE chunk), ordering is
+        # relatively relaxed.  With one, gAMA chunk must precede PLTE
+        # chunk which must precede tRNS and bKGD.
+        # See http://www.w3.org/TR/PNG/#5ChunkOrdering
+        if self.palette:
+            p,t = self.make_palette()
+            write_chunk(outfile, 'PLTE', p)
+            if t:
+                # tRNS chunk is optional.  Only needed if palette entries
+                # have alpha.
+                write_chunk(outfile, 'tRNS', t)
+
+        # http://www.w3.org/TR/PNG/#11tRNS
+        if self.transparent is not None:
+            if self.greyscale:
+                write_chunk(outfile, 'tRNS',
+                            struct.pack("!1H", *self.transparent))
+            else:
+                write_chunk(outfile, 'tRNS',
+                            struct.pack("!3H", *self.transparent))
+
+        # http://www.w3.org/TR/PNG/#11bKGD
+        if self.background is not None:
+            if self.greyscale:
+                write_chunk(outfile, 'bKGD',
+                            struct.pack("!1H", *self.background))
+            else:
+                write_chunk(outfile, 'bKGD',
+                            struct.pack("!3H", *self.background))
+
+    def stream(self, outfile, threads=1):
+        """
+        Start writing a straightlaced PNG image to the output file,
+        returning a :class:`StreamWriter` that rows are pushed to one
+        at a time.  See also :meth:`write` method.
+
+        With `threads` greater than 1 the image data is compressed
+        on that many threads, see :class:`ParallelCompressor`.
+        """
+
+        return StreamWriter(self, outfile, threads=threads)
+
     def write_array(self, outfile, pixels):
         """
         Write an array in flat row flat pixel format as a PNG file on
@@ -963,6 +1004,202 @@ class Writer:
                             pixels[offset+i:end_offset:skip]
                     yield row
 
+class StreamWriter:
+    """
+    Incremental PNG writer: rows are filtered and compressed as they
+    are pushed, and compressed data is written out in ``IDAT`` chunks
+    of about `chunk_limit` bytes each.  Only a few rows are held in
+    memory at a time.
+    """
+
+    def __init__(self, writer, outfile, threads=1):
+        if writer.interlace:
+            raise ValueError("can't stream an interlaced image")
+        if writer.bitdepth not in (8, 16) or writer.rescale:
+            raise ValueError("can only stream 8 or 16 bit images")
+        self.writer = writer
+        self.outfile = outfile
+        self.nrows = 0
+        if threads > 1:
+            self.compressor = ParallelCompressor(writer.compression,
+                                                 threads=threads)
+        elif writer.compression is not None:
+            self.compressor = zlib.compressobj(writer.compression)
+        else:
+            self.compressor = zlib.compressobj()
+        self.pending = []
+        self.npending = 0
+        writer.write_preamble(outfile)
+
+    def _pack(self, row):
+        if self.writer.bitdepth == 8:
+            if isinstance(row, bytearray):
+                return bytes(row)
+            if not isarray(row) or row.typecode != 'B':
+                row = array('B', row)
+            return tostring(row)
+        row = array('H', row)
+        if sys.byteorder == 'little':
+            row.byteswap()
+        return tostring(row)
+
+    def write_row(self, row):
+        """
+        Push the next row, in boxed row flat pixel format.  Every
+        row is given the "None" filter type, as in
+        :meth:`Writer.write_passes`.
+        """
+
+        if self.nrows >= self.writer.height:
+            raise ValueError("more rows supplied than height (%d)" %
+                             self.writer.height)
+        self.nrows += 1
+        data = self.compressor.compress(strtobytes('\0') + self._pack(row))
+        if data:
+            self.pending.append(data)
+            self.npending += len(data)
+            if self.npending >= self.writer.chunk_limit:
+                self._write_idat()
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write_row(row)
+
+    def _write_idat(self):
+        write_chunk(self.outfile, 'IDAT', strtobytes('').join(self.pending))
+        self.pending = []
+        self.npending = 0
+
+    def close(self):
+        """
+        Flush remaining compressed data and finish the image.
+        """
+
+        if self.nrows != self.writer.height:
+            self.abort()
+            raise ValueError(
+              "rows supplied (%d) does not match height (%d)" %
+              (self.nrows, self.writer.height))
+        data = self.compressor.flush()
+        if data:
+            self.pending.append(data)
+        if self.pending:
+            self._write_idat()
+        # http://www.w3.org/TR/PNG/#11IEND
+        write_chunk(self.outfile, 'IEND')
+
+    def abort(self):
+        """
+        Give up on the image, stopping any compression threads.
+        """
+
+        close = getattr(self.compressor, 'close', None)
+        if close is not None:
+            close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        """
+        Finish the image, or abort it if the block raised.
+        """
+
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+class ParallelCompressor:
+    """
+    Stand-in for a ``zlib.compressobj`` that deflates the data in
+    blocks of `block_size` bytes on a pool of `threads` threads (zlib
+    releases the GIL while compressing).
+
+    Every block but the last is ended with ``Z_SYNC_FLUSH``, which
+    byte-aligns the raw deflate output, so the blocks concatenate into
+    a single valid zlib stream.  The Adler-32 checksum is kept over the
+    uncompressed data as it is submitted.  Each block starts with an
+    empty window, which costs a little compression near block starts.
+    """
+
+    def __init__(self, level=None, threads=2, block_size=2**18):
+        from multiprocessing.pool import ThreadPool
+
+        if level is None or level < 0:
+            level = 6
+        self.level = level
+        self.block_size = block_size
+        self.pool = ThreadPool(threads)
+        self.max_pending = 2 * threads
+        # http://www.ietf.org/rfc/rfc1950.txt
+        cmf = 0x78
+        flg = (level >= 2) + (level >= 6) + (level >= 7)
+        flg <<= 6
+        flg += 31 - (cmf * 256 + flg) % 31
+        self.header = struct.pack("!2B", cmf, flg)
+        self.adler = 1
+        self.buf = []
+        self.nbuf = 0
+        self.pending = []
+
+    def _deflate(self, data, last):
+        c = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        if last:
+            return c.compress(data) + c.flush(zlib.Z_FINISH)
+        return c.compress(data) + c.flush(zlib.Z_SYNC_FLUSH)
+
+    def _submit(self, last=False):
+        data = strtobytes('').join(self.buf)
+        self.buf = []
+        self.nbuf = 0
+        self.adler = zlib.adler32(data, self.adler)
+        self.pending.append(self.pool.apply_async(self._deflate,
+                                                  (data, last)))
+
+    def _collect(self, wait=False):
+        out = []
+        if self.header:
+            out.append(self.header)
+            self.header = None
+        while self.pending and (wait or self.pending[0].ready() or
+                                len(self.pending) > self.max_pending):
+            out.append(self.pending.pop(0).get())
+        return strtobytes('').join(out)
+
+    def compress(self, data):
+        self.buf.append(data)
+        self.nbuf += len(data)
+        if self.nbuf < self.block_size:
+            return strtobytes('')
+        self._submit()
+        return self._collect()
+
+    def flush(self):
+        self._submit(last=True)
+        try:
+            data = self._collect(wait=True)
+        finally:
+            self.close()
+        return data + struct.pack("!I", self.adler & 0xffffffff)
+
+    def close(self):
+        """
+        Stop the worker threads, dropping any blocks not yet collected.
+        Called by :meth:`flush`, and safe to call more than once.
+        """
+
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
 def write_chunk(outfile, tag, data=strtobytes('')):
     """
     Write a PNG chunk to the output file, including length and
@@ -1603,6 +1840,82 @@ class Reader:
                             flat[i::self.planes]
         return a
 
+    def iterdeinterlace(self, raw):
+        """Iterator that undoes filters and deinterlaces, yielding each
+        row in boxed row flat pixel format.  `raw` should be an iterable
+        that yields the raw bytes in chunks of arbitrary size.
+
+        Unlike :meth:`deinterlace`, this never holds the whole image.
+        Pass 7 is exactly the odd rows, so only the reduced images of
+        passes 1 to 6, half of the pixels, are kept.  Their scanlines
+        are dropped as the rows they belong to are yielded, and pass 7
+        is streamed.
+        """
+
+        vpr = self.width * self.planes
+        fmt = 'BH'[self.bitdepth > 8]
+        chunks = iter(raw)
+        # Decompressed data not yet consumed, and the offset into it.
+        buf = [strtobytes(''), 0]
+
+        def take(n):
+            data, offset = buf
+            while len(data) - offset < n:
+                try:
+                    some = chunks.next()
+                except StopIteration:
+                    raise FormatError(
+                      'Not enough decompressed data for interlaced image.')
+                data = data[offset:] + some
+                offset = 0
+            buf[:] = [data, offset + n]
+            return data[offset:offset+n]
+
+        def iterpass(xstart, ystart, xstep, ystep):
+            """Yield the flat scanlines of the reduced image of a
+            pass."""
+            # Pixels per row (reduced pass image)
+            ppr = int(math.ceil((self.width-xstart)/float(xstep)))
+            # Row size in bytes for this pass.
+            row_size = int(math.ceil(self.psize * ppr))
+            recon = None
+            for y in range(ystart, self.height, ystep):
+                line = take(row_size + 1)
+                scanline = array('B', line[1:])
+                recon = self.undo_filter(ord(line[0]), scanline, recon)
+                yield self.serialtoflat(recon, ppr)
+
+        def assemble(y):
+            """Put together row `y` from the stored passes."""
+            row = array(fmt, [0]) * vpr
+            for xstart, ystart, xstep, ystep, lines in passes:
+                if y < ystart or (y - ystart) % ystep:
+                    continue
+                i = (y - ystart) // ystep
+                flat, lines[i] = lines[i], None
+                offset = xstart * self.planes
+                skip = self.planes * xstep
+                for p in range(self.planes):
+                    row[offset+p::skip] = flat[p::self.planes]
+            return row
+
+        # Read passes 1 to 6, keeping their reduced images.
+        passes = []
+        for xstart, ystart, xstep, ystep in _adam7[:-1]:
+            if xstart >= self.width:
+                continue
+            lines = list(iterpass(xstart, ystart, xstep, ystep))
+            passes.append((xstart, ystart, xstep, ystep, lines))
+
+        # Pass 7 supplies every odd row whole; the even rows are
+        # complete by now.
+        odd = iterpass(*_adam7[-1])
+        for y in range(self.height):
+            if y % 2:
+                yield array(fmt, odd.next())
+            else:
+                yield assemble(y)
+
     def iterboxed(self, rows):
         """Iterator that yields each scanline in boxed row flat pixel
         format.  `rows` should be an iterator that yields the bytes of
@@ -1619,15 +1932,11 @@ class Reader:
                 raw = tostring(raw)
                 return array('H', struct.unpack('!%dH' % (len(raw)//2), raw))
             assert self.bitdepth < 8
-            width = self.width
-            # Samples per byte
-            spb = 8//self.bitdepth
-            out = array('B')
-            mask = 2**self.bitdepth - 1
-            shifts = map(self.bitdepth.__mul__, reversed(range(spb)))
-            for o in raw:
-                out.extend(map(lambda i: mask&(o>>i), shifts))
-            return out[:width]
+            out = strtobytes('').join(map(table.__getitem__, raw))
+            return array('B', out[:self.width])
+
+        if self.bitdepth < 8:
+            table = sample_table(self.bitdepth)
 
         return itertools.imap(asvalues, rows)
 
@@ -1645,17 +1954,13 @@ class Reader:
         assert self.bitdepth < 8
         if width is None:
             width = self.width
-        # Samples per byte
-        spb = 8//self.bitdepth
+        # Each row is padded to a whole number of bytes.
+        table = sample_table(self.bitdepth)
+        rb = int(math.ceil(width * self.bitdepth / 8.0))
         out = array('B')
-        mask = 2**self.bitdepth - 1
-        shifts = map(self.bitdepth.__mul__, reversed(range(spb)))
-        l = width
-        for o in bytes:
-            out.extend([(mask&(o>>s)) for s in shifts][:l])
-            l -= spb
-            if l <= 0:
-                l = width
+        for i in range(0, len(bytes), rb):
+            row = map(table.__getitem__, bytes[i:i+rb])
+            out.fromstring(strtobytes('').join(row)[:width])
         return out
 
     def iterstraight(self, raw):
@@ -1686,6 +1991,33 @@ class Reader:
               'Wrong size for decompressed IDAT chunk.')
         assert len(a) == 0
 
+    def iterstraight_direct(self, raw):
+        """Like :meth:`iterstraight`, but `raw` should yield strings,
+        and each row is sliced out of them directly rather than passing
+        through an intermediate buffer.  Only for bit depths of 8,
+        where the result is in boxed row flat pixel format.
+        """
+
+        # length of row, including the filter type byte
+        rb = self.row_bytes + 1
+        recon = None
+        pending = strtobytes('')
+        for some in raw:
+            if pending:
+                some = pending + some
+            end = len(some) - len(some) % rb
+            for offset in xrange(0, end, rb):
+                scanline = array('B', some[offset+1:offset+rb])
+                recon = self.undo_filter(ord(some[offset]), scanline, recon)
+                yield recon
+            pending = some[end:]
+        if pending:
+            # :file:format We get here with a file format error: when the
+            # available bytes (after decompressing) do not pack into exact
+            # rows.
+            raise FormatError(
+              'Wrong size for decompressed IDAT chunk.')
+
     def validate_signature(self):
         """If signature (header) has not been read then read and
         validate it; otherwise do nothing.
@@ -1876,53 +2208,18 @@ class Reader:
         checksum failures will raise warnings rather than exceptions.
         """
 
-        def iteridat():
-            """Iterator that yields all the ``IDAT`` chunks as strings."""
-            while True:
-                try:
-                    type, data = self.chunk(lenient=lenient)
-                except ValueError, e:
-                    raise ChunkError(e.args[0])
-                if type == 'IEND':
-                    # http://www.w3.org/TR/PNG/#11IEND
-                    break
-                if type != 'IDAT':
-                    continue
-                # type == 'IDAT'
-                # http://www.w3.org/TR/PNG/#11IDAT
-                if self.colormap and not self.plte:
-                    warnings.warn("PLTE chunk is required before IDAT chunk")
-                yield data
-
-        def iterdecomp(idat):
-            """Iterator that yields decompressed strings.  `idat` should
-            be an iterator that yields the ``IDAT`` chunk data.
-            """
-
-            # Currently, with no max_length paramter to decompress, this
-            # routine will do one yield per IDAT chunk.  So not very
-            # incremental.
-            d = zlib.decompressobj()
-            # Each IDAT chunk is passed to the decompressor, then any
-            # remaining state is decompressed out.
-            for data in idat:
-                # :todo: add a max_length argument here to limit output
-                # size.
-                yield array('B', d.decompress(data))
-            yield array('B', d.flush())
-
         self.preamble(lenient=lenient)
-        raw = iterdecomp(iteridat())
+        raw = self.idatdecomp(lenient=lenient)
 
         if self.interlace:
-            raw = array('B', itertools.chain(*raw))
-            arraycode = 'BH'[self.bitdepth>8]
-            # Like :meth:`group` but producing an array.array object for
-            # each row.
-            pixels = itertools.imap(lambda *row: array(arraycode, row),
-                       *[iter(self.deinterlace(raw))]*self.width*self.planes)
+            pixels = self.iterdeinterlace(raw)
+        elif self.bitdepth == 8:
+            # Fast path: rows are already in boxed row flat pixel
+            # format once unfiltered.
+            pixels = self.iterstraight_direct(raw)
         else:
-            pixels = self.iterboxed(self.iterstraight(raw))
+            pixels = self.iterboxed(self.iterstraight(
+                       itertools.imap(array, itertools.repeat('B'), raw)))
         meta = dict()
         for attr in 'greyscale alpha planes bitdepth interlace'.split():
             meta[attr] = getattr(self, attr)
@@ -1936,6 +2233,39 @@ class Reader:
         return self.width, self.height, pixels, meta
 
 
+    def idat(self, lenient=False):
+        """Iterator that yields all the ``IDAT`` chunks as strings."""
+        while True:
+            try:
+                type, data = self.chunk(lenient=lenient)
+            except ValueError, e:
+                raise ChunkError(e.args[0])
+            if type == 'IEND':
+                # http://www.w3.org/TR/PNG/#11IEND
+                break
+            if type != 'IDAT':
+                continue
+            # type == 'IDAT'
+            # http://www.w3.org/TR/PNG/#11IDAT
+            if self.colormap and not self.plte:
+                warnings.warn("PLTE chunk is required before IDAT chunk")
+            yield data
+
+    def idatdecomp(self, lenient=False):
+        """Iterator that yields decompressed ``IDAT`` strings."""
+
+        # Currently, with no max_length paramter to decompress, this
+        # routine will do one yield per IDAT chunk.  So not very
+        # incremental.
+        d = zlib.decompressobj()
+        # Each IDAT chunk is passed to the decompressor, then any
+        # remaining state is decompressed out.
+        for data in self.idat(lenient):
+            # :todo: add a max_length argument here to limit output
+            # size.
+            yield d.decompress(data)
+        yield d.flush()
+
     def read_flat(self):
         """
         Read a PNG file and decode it into flat row flat pixel format.
@@ -2028,11 +2358,12 @@ class Reader:
             meta['alpha'] = bool(self.trns)
             meta['bitdepth'] = 8
             meta['planes'] = 3 + bool(self.trns)
-            plte = self.palette()
+            # Lookup table from index to the packed palette entry.
+            plte = [tostring(array('B', entry)) for entry in self.palette()]
             def iterpal(pixels):
                 for row in pixels:
                     row = map(plte.__getitem__, row)
-                    yield array('B', itertools.chain(*row))
+                    yield array('B', strtobytes('').join(row))
             pixels = iterpal(pixels)
         elif self.trns:
             # It would be nice if there was some reasonable way of doing
@@ -2047,19 +2378,28 @@ class Reader:
             meta['alpha'] = True
             meta['planes'] += 1
             typecode = 'BH'[meta['bitdepth']>8]
-            def itertrns(pixels):
-                for row in pixels:
-                    # For each row we group it into pixels, then form a
-                    # characterisation vector that says whether each pixel
-                    # is opaque or not.  Then we convert True/False to
-                    # 0/maxval (by multiplication), and add it as the extra
-                    # channel.
-                    row = group(row, planes)
-                    opa = map(it.__ne__, row)
-                    opa = map(maxval.__mul__, opa)
-                    opa = zip(opa) # convert to 1-tuples
-                    yield array(typecode,
-                      itertools.chain(*map(operator.add, row, opa)))
+            if planes == 1 and meta['bitdepth'] <= 8:
+                # Lookup table from grey value to the packed LA pair.
+                table = [struct.pack('2B', v, maxval*((v,) != it))
+                         for v in range(maxval+1)]
+                def itertrns(pixels):
+                    for row in pixels:
+                        row = map(table.__getitem__, row)
+                        yield array('B', strtobytes('').join(row))
+            else:
+                def itertrns(pixels):
+                    for row in pixels:
+                        # For each row we group it into pixels, then form a
+                        # characterisation vector that says whether each pixel
+                        # is opaque or not.  Then we convert True/False to
+                        # 0/maxval (by multiplication), and add it as the extra
+                        # channel.
+                        row = group(row, planes)
+                        opa = map(it.__ne__, row)
+                        opa = map(maxval.__mul__, opa)
+                        opa = zip(opa) # convert to 1-tuples
+                        yield array(typecode,
+                          itertools.chain(*map(operator.add, row, opa)))
             pixels = itertrns(pixels)
         targetbitdepth = None
         if self.sbit:
@@ -2182,6 +2522,24 @@ class Reader:
         ``metadata['alpha']`` will be ``True``.
         """
 
+        self.preamble()
+        if self.colormap and not self.sbit:
+            # Expand indices straight to RGBA, rather than to RGB first
+            # when there is no ``tRNS`` chunk.
+            width,height,pixels,meta = self.read()
+            plte = self.palette(alpha='force')
+            plte = [tostring(array('B', entry)) for entry in plte]
+            def iterpal():
+                for row in pixels:
+                    row = map(plte.__getitem__, row)
+                    yield array('B', strtobytes('').join(row))
+            meta['colormap'] = False
+            meta['alpha'] = True
+            meta['greyscale'] = False
+            meta['bitdepth'] = 8
+            meta['planes'] = 4
+            return width,height,iterpal(),meta
+
         width,height,pixels,meta = self.asDirect()
         if meta['alpha'] and not meta['greyscale']:
             return width,height,pixels,meta
@@ -2337,10 +2695,16 @@ except:
         def undo_filter_up(filter_unit, scanline, previous, result):
             """Undo up filter."""
 
-            for i in range(len(result)):
-                x = scanline[i]
-                b = previous[i]
-                result[i] = (x + b) & 0xff
+            # Add all bytes at once as big integers, keeping carries
+            # from crossing byte boundaries: the low seven bits of
+            # each byte are added, and the top bit is xored in.
+            n = len(result)
+            lo = int('7f' * n, 16)
+            hi = int('80' * n, 16)
+            a = int(binascii.hexlify(scanline), 16)
+            b = int(binascii.hexlify(previous), 16)
+            x = ((a & lo) + (b & lo)) ^ ((a ^ b) & hi)
+            result[:] = array('B', binascii.unhexlify('%0*x' % (2*n, x)))
         undo_filter_up = staticmethod(undo_filter_up)
 
         def undo_filter_average(filter_unit, scanline, previous, result):
@@ -2361,28 +2725,27 @@ except:
         def undo_filter_paeth(filter_unit, scanline, previous, result):
             """Undo Paeth filter."""
 
-            # Also used for ci.
-            ai = -filter_unit
-            for i in range(len(result)):
-                x = scanline[i]
-                if ai < 0:
-                    a = c = 0
-                else:
-                    a = result[ai]
-                    c = previous[ai]
+            fu = filter_unit
+            # With a = c = 0 for the first pixel, the predictor is b.
+            for i in range(min(fu, len(result))):
+                result[i] = (scanline[i] + previous[i]) & 0xff
+            for i in range(fu, len(result)):
+                a = result[i-fu]
                 b = previous[i]
-                p = a + b - c
-                pa = abs(p - a)
-                pb = abs(p - b)
-                pc = abs(p - c)
+                c = previous[i-fu]
+                # pa, pb, pc as in the spec, with p = a + b - c.
+                pa = b - c
+                pb = a - c
+                pc = pa + pb
+                if pa < 0: pa = -pa
+                if pb < 0: pb = -pb
+                if pc < 0: pc = -pc
                 if pa <= pb and pa <= pc:
-                    pr = a
+                    result[i] = (scanline[i] + a) & 0xff
                 elif pb <= pc:
-                    pr = b
+                    result[i] = (scanline[i] + b) & 0xff
                 else:
-                    pr = c
-                result[i] = (x + pr) & 0xff
-                ai += 1
+                    result[i] = (scanline[i] + c) & 0xff
         undo_filter_paeth = staticmethod(undo_filter_paeth)
 
         def convert_la_to_rgba(row, result):
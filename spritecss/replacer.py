@@ -4,27 +4,129 @@ import logging
 
 from . import SpriteRef
 from .css import split_declaration
+from .css.parser import AtBlock, Selector, Declaration, BlockEnd, \
+                        Whitespace, iter_print_css
 from .finder import NoSpriteFound, get_background_url, excluded_repeat
 
 logger = logging.getLogger(__name__)
 
+#: media query for high resolution spritemaps
+RETINA_MEDIA = ("media (-webkit-min-device-pixel-ratio: 2), "
+                "(min-resolution: 192dpi) ")
+
 def _build_pos_map(smap, placements):
-    """Build a dict of sprite ref => pos."""
-    return dict((n.fname, p) for (p, n) in placements)
+    """Build a dict of sprite ref => (spritemap, pos)."""
+    return dict((n.fname, (smap, p)) for (p, n) in placements)
 
 class SpriteReplacer(object):
     def __init__(self, spritemaps):
-        self._smaps = dict((sm.fname, _build_pos_map(sm, plcs))
-                           for (sm, plcs) in spritemaps)
+        # keyed by the mapped name, as parts of a split map share a mapping
+        self._smaps = {}
+        for (sm, plcs) in spritemaps:
+            pos_map = self._smaps.setdefault(sm.origin, {})
+            pos_map.update(_build_pos_map(sm, plcs))
 
     def __call__(self, css):
+        """Iterate over the parser events of *css* with sprite references
+        replaced.
+        """
+        with css.open_parser() as p:
+            for (ev, new_evs) in self._iter_replaced(css, p):
+                if new_evs is None:
+                    yield ev
+                else:
+                    for new_ev in new_evs:
+                        yield new_ev
+
+    def iter_edits(self, css):
+        """Yield (start, end, code) tuples to replace the code of *css* from
+        offset start up to end with, in order.
+        """
         with css.open_parser() as p:
-            for ev in p:
-                if ev.lexeme == "declaration":
-                    ev = self._replace_ev(css, ev)
-                yield ev
+            for (ev, new_evs) in self._iter_replaced(css, p):
+                if new_evs is None:
+                    continue
+                elif ev.lexeme == "declaration":
+                    # the original terminator stays in place after the code
+                    code = ";".join(new_ev.declaration for new_ev in new_evs)
+                    yield (ev.start, ev.offset, code)
+                else:
+                    code = "".join(iter_print_css(new_evs[1:]))
+                    yield (ev.offset + 1, ev.offset + 1, code)
+
+    def iter_spliced(self, css, source_map=None):
+        """Iterate over the code of *css* with sprite references replaced,
+        copying everything in between verbatim.
+
+        The output is mapped onto *source_map* as it goes, if given.
+        """
+        edits = list(self.iter_edits(css))
+        with css.open_data() as data:
+            pos = 0
+            for (start, end, code) in edits:
+                if source_map is not None:
+                    source_map.add_copy(data, pos, start)
+                    source_map.add_code(code, start)
+                yield data[pos:start]
+                yield code
+                pos = end
+            if source_map is not None:
+                source_map.add_copy(data, pos, len(data))
+            yield data[pos:]
+
+    def _iter_replaced(self, css, evs):
+        """Yield (event, replacement events) for each of *evs*, the latter
+        being None for events which stay as they are.
+        """
+        selector = retina = None
+        for ev in evs:
+            new_evs = None
+            if ev.lexeme == "selector":
+                selector = ev.selector
+            elif ev.lexeme == "declaration":
+                (new_ev, smap) = self._replace_ev(css, ev)
+                if smap is not None:
+                    new_evs = [new_ev]
+                    if smap.retina:
+                        retina = smap
+                    if smap.alternatives:
+                        new_evs.append(self._image_set_event(css, smap))
+            elif ev.lexeme == "block_end" and retina is not None:
+                new_evs = [ev] + self._retina_events(css, selector, retina)
+                retina = None
+            yield (ev, new_evs)
+
+    def _image_set_event(self, css, smap):
+        """Make a declaration offering the alternative formats of *smap*,
+        which browsers without image-set() support skip.
+        """
+        cands = ["url('%s') type('%s')" % (css.conf.get_spritemap_url(fn), mt)
+                 for (fn, mt) in smap.alternatives]
+        return Declaration(" background-image: image-set(%s)" %
+                           (", ".join(cands),))
+
+    def _retina_events(self, css, selector, smap):
+        """Make events for a media query block switching *selector* over to
+        the high resolution version of *smap*.
+        """
+        (retina_fn, (width, height)) = smap.retina
+        url = css.conf.get_spritemap_url(retina_fn)
+        return [Whitespace("\n"),
+                AtBlock(RETINA_MEDIA),
+                Whitespace("\n  "),
+                Selector(selector.strip() + " "),
+                Declaration(" background-image: url('%s')" % (url,)),
+                Declaration(" background-size: %dpx %dpx" % (width, height)),
+                Whitespace(" "),
+                BlockEnd(),
+                Whitespace("\n"),
+                BlockEnd()]
 
     def _replace_ev(self, css, ev):
+        """Replace the sprite reference in declaration *ev*, if any, giving
+        the event and the spritemap it was replaced with.
+        """
+        smap = None
         (prop, val) = split_declaration(ev.declaration)
         if prop == "background":
             try:
@@ -35,23 +137,22 @@ class SpriteReplacer(object):
                 sref = SpriteRef(css.conf.normpath(url),
                                  source=css.fname)
                 try:
-                    if excluded_repeat(val):
-                        new = val
-                    else:
-                        new = self._replace_val(css, ev, sref)
+                    if not excluded_repeat(val):
+                        (new, smap) = self._replace_val(css, ev, sref)
+                        ev = Declaration("%s: %s" % (prop, new),
+                                         ev.offset, ev.start)
                 except KeyError:
-                    new = val
-                ev.declaration = "%s: %s" % (prop, new)
-        return ev
+                    pass
+        return (ev, smap)
 
     def _replace_val(self, css, ev, sref):
-        sm_fn = css.mapper(sref)
-        pos = self._smaps[sm_fn][sref]
-        sm_url = css.conf.get_spritemap_url(sm_fn)
-        logger.debug("replace bg %s at L%d with spritemap %s at %s",
-                     sref, ev.state.token.line_no, sm_url, pos)
+        (smap, pos) = self._smaps[css.mapper(sref)][sref]
+        sm_url = css.conf.get_spritemap_url(smap.fname)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("replace bg %s at L%d with spritemap %s at %s",
+                         sref, css.position(ev.start)[0], sm_url, pos)
 
         parts = ["url('%s')" % (sm_url,), "no-repeat"]
         for r in pos:
             parts.append(("-%dpx" % r) if r else "0")
-        return " ".join(parts)
+        return (" ".join(parts), smap)
@@ -5,6 +5,19 @@ from itertools import izip, chain, repeat
 
 from .image import Image
 
+def iter_rescaled(rows, bitdepth, targetbitdepth):
+    """Rescale the sample values of *rows* from *bitdepth* to
+    *targetbitdepth*, so that sprites of different depths can share a
+    spritemap.
+    """
+    if bitdepth == targetbitdepth:
+        return iter(rows)
+    typecode = "BH"[targetbitdepth > 8]
+    (maxval, targetmaxval) = (2 ** bitdepth - 1, 2 ** targetbitdepth - 1)
+    table = [(v * targetmaxval + maxval // 2) // maxval
+             for v in xrange(maxval + 1)]
+    return (array(typecode, map(table.__getitem__, row)) for row in rows)
+
 class StitchedSpriteNodes(object):
     """An iterable that yields the image data rows of a tree of sprite
     nodes. Suitable for writing to an image.
@@ -52,7 +65,9 @@ class StitchedSpriteNodes(object):
                 # entail very complicated algorithms :<
                 raise ValueError("node %r has too many children" % (n,))
         elif hasattr(n, "box"):
-            return self._pad_trans(n.box.im.pixels, n)
+            im = n.box.im
+            rows = iter_rescaled(im.pixels, im.bitdepth, self.bitdepth)
+            return self._pad_trans(rows, n)
         else:
             return self.iter_empty_rows(n)
 
@@ -68,6 +83,41 @@ def stitch(packed, mode="RGBA", reusable=False):
         pixels = list(pixels)
     return Image(root.width, root.height, pixels, meta)
 
+def iter_paste_rows(size, pieces, bitdepth=8):
+    """Yield the RGBA rows of an image of *size* and *bitdepth* made from
+    *pieces*, a sequence of (position, image) pairs, reading each piece's
+    rows only as they are reached.
+    """
+    (width, height) = size
+    pending = sorted(pieces, key=lambda piece: piece[0][1], reverse=True)
+    if bitdepth > 8:
+        new_row = lambda: array("H", [0]) * (width * 4)
+    else:
+        new_row = lambda: bytearray(width * 4)
+    active = []
+    for y in xrange(height):
+        while pending and pending[-1][0][1] == y:
+            ((x, y1), im) = pending.pop()
+            rows = iter_rescaled(im.pixels, im.bitdepth, bitdepth)
+            active.append((x * 4, y1 + im.height, rows))
+        row = new_row()
+        for (a1, y2, pixels) in active:
+            px = next(pixels)
+            row[a1:a1 + len(px)] = px
+        yield row
+        active = [act for act in active if act[1] > y + 1]
+
+def paste(size, pieces):
+    """Make an RGBA image of *size* from *pieces*, a sequence of (position,
+    image) pairs, as deep as the deepest piece. The rows are produced lazily,
+    so the pieces must stay open until the image is written.
+    """
+    (width, height) = size
+    pieces = list(pieces)
+    bd = max([im.bitdepth for (pos, im) in pieces] or [8])
+    meta = {"bitdepth": bd, "alpha": True}
+    return Image(width, height, iter_paste_rows(size, pieces, bd), meta)
+
 def _pack_and_stitch(smap_fn, sprites, conf=None):
     import sys
 
@@ -0,0 +1,34 @@
+import os
+import shutil
+import tempfile
+from nose.tools import eq_
+from spritecss.config import CSSConfig
+
+def test_hash_urls():
+    root = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(root, "img", "sprites.png")
+        os.mkdir(os.path.dirname(fname))
+        with open(fname, "wb") as fp:
+            fp.write("first")
+        eq_(CSSConfig(root=root).get_spritemap_url(fname), "img/sprites.png")
+        conf = CSSConfig(base={"hash_urls": "query"}, root=root)
+        first = conf.get_spritemap_url(fname)
+        eq_(first, "img/sprites.png?e0996a37c13d")
+        with open(fname, "ab") as fp:
+            fp.write(" and second")
+        assert conf.get_spritemap_url(fname) != first
+        eq_(conf.get_spritemap_hashed_out(fname, "e0996a37c13d44c3"),
+            os.path.join(root, "img", "sprites.e0996a37c13d.png"))
+    finally:
+        shutil.rmtree(root)
+
+def test_memoized_paths():
+    conf = CSSConfig(base={"sprite_dirs": "img 'more img'"}, root="/site")
+    eq_(conf.sprite_dirs, ["/site/img", "/site/more img"])
+    # callers get their own list to change
+    conf.sprite_dirs.append("/elsewhere")
+    eq_(conf.sprite_dirs, ["/site/img", "/site/more img"])
+    eq_(conf.normpath("img/../a.png"), "/site/a.png")
+    assert conf.normpath("img/../a.png") is conf.normpath("img/../a.png")
+    eq_(conf.get_spritemap_url("/site/img.png"), "img.png")
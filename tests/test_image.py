@@ -0,0 +1,301 @@
+import random
+import zlib
+from StringIO import StringIO
+from nose.tools import eq_
+from spritecss import png
+from spritecss.image import Image
+
+def make_rows(width, height, seed=0):
+    rand = random.Random(seed)
+    return [bytearray(rand.randrange(256) for i in xrange(width * 4))
+            for y in xrange(height)]
+
+def read_rows(data):
+    (width, height, pixels, meta) = png.Reader(bytes=data).asRGBA8()
+    return (width, height, [bytearray(row) for row in pixels])
+
+def test_stream_roundtrip():
+    rows = make_rows(97, 150)
+    fo = StringIO()
+    im = Image(97, 150, iter(rows), {"bitdepth": 8, "alpha": True})
+    im.save(fo, chunk_limit=1024)
+    data = fo.getvalue()
+    eq_(read_rows(data), (97, 150, rows))
+    # a small chunk limit spreads the image data over several chunks
+    chunks = list(png.Reader(bytes=data).chunks())
+    assert len([t for (t, v) in chunks if t == "IDAT"]) > 1
+
+def test_stream_row_count():
+    w = png.Writer(4, 3, alpha=True)
+    sw = w.stream(StringIO())
+    sw.write_rows(make_rows(4, 2))
+    try:
+        sw.close()
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("expected ValueError")
+
+def test_paste():
+    from spritecss.stitch import paste
+    meta = {"bitdepth": 8, "alpha": True}
+    a = Image(2, 2, make_rows(2, 2), meta)
+    b = Image(3, 1, make_rows(3, 1), meta)
+    im = paste((5, 4), [((3, 2), a), ((0, 1), b)])
+    rows = list(im.pixels)
+    eq_(len(rows), 4)
+    eq_(rows[0], bytearray(20))
+    eq_(rows[1], make_rows(3, 1)[0] + bytearray(8))
+    eq_(rows[2], bytearray(12) + make_rows(2, 2)[0])
+    eq_(rows[3], bytearray(12) + make_rows(2, 2)[1])
+
+def test_paste_mixed_depths():
+    from array import array
+    from spritecss.stitch import paste
+    a = Image(1, 1, [bytearray([0, 128, 255, 255])],
+              {"bitdepth": 8, "alpha": True})
+    b = Image(1, 1, [array("H", [1, 2, 3, 65535])],
+              {"bitdepth": 16, "alpha": True})
+    im = paste((2, 1), [((0, 0), a), ((1, 0), b)])
+    eq_(im.bitdepth, 16)
+    im.reusable()
+    eq_(list(im.pixels[0]),
+        [0, 128 * 257, 65535, 65535, 1, 2, 3, 65535])
+    fo = StringIO()
+    im.save(fo)
+    (w, h, pixels, meta) = png.Reader(bytes=fo.getvalue()).asRGBA()
+    eq_(meta["bitdepth"], 16)
+    eq_([list(row) for row in pixels],
+        [[0, 128 * 257, 65535, 65535, 1, 2, 3, 65535]])
+
+def test_parallel_compress():
+    data = "".join(str(row) for row in make_rows(64, 64)) * 4
+    c = png.ParallelCompressor(threads=3, block_size=5000)
+    out = "".join(c.compress(data[i:i + 1000])
+                  for i in xrange(0, len(data), 1000)) + c.flush()
+    eq_(zlib.decompress(out), data)
+
+def test_stream_threaded():
+    rows = make_rows(97, 150)
+    fo = StringIO()
+    im = Image(97, 150, iter(rows), {"bitdepth": 8, "alpha": True})
+    im.save(fo, threads=2)
+    eq_(read_rows(fo.getvalue()), (97, 150, rows))
+
+def test_stream_threaded_error():
+    import threading
+    def rows():
+        for row in make_rows(97, 100):
+            yield row
+        raise RuntimeError("stitching failed")
+    threads = threading.active_count()
+    im = Image(97, 150, rows(), {"bitdepth": 8, "alpha": True})
+    try:
+        im.save(StringIO(), threads=3)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("expected RuntimeError")
+    # the compression threads are gone along with the image
+    eq_(threading.active_count(), threads)
+
+def write_png(rows, **kwds):
+    fo = StringIO()
+    png.Writer(len(rows[0]), len(rows), **kwds).write(fo, rows)
+    return fo.getvalue()
+
+def test_palette_expansion():
+    rows = [[0, 1, 2, 1, 0], [2, 2, 0, 1, 1]]
+    for (palette, bitdepth) in [
+            ([(40, 50, 60, 128), (70, 80, 90, 0), (10, 20, 30)], 2),
+            ([(40, 50, 60, 128), (70, 80, 90, 0), (10, 20, 30)], 8),
+            ([(10, 20, 30), (40, 50, 60), (70, 80, 90)], 4)]:
+        data = write_png(rows, palette=palette, bitdepth=bitdepth)
+        (w, h, pixels, meta) = png.Reader(bytes=data).asRGBA()
+        eq_(meta["planes"], 4)
+        for (row, got) in zip(rows, pixels):
+            expected = []
+            for idx in row:
+                expected.extend(palette[idx] + (255,) * (4 - len(palette[idx])))
+            eq_(list(got), expected)
+
+def test_grey_transparent():
+    rows = [[0, 7, 255], [7, 7, 3]]
+    data = write_png(rows, greyscale=True, transparent=7)
+    (w, h, pixels, meta) = png.Reader(bytes=data).asRGBA()
+    for (row, got) in zip(rows, pixels):
+        expected = []
+        for v in row:
+            expected.extend((v, v, v, 0 if v == 7 else 255))
+        eq_(list(got), expected)
+
+def check_interlaced(name):
+    interlaced = png.Reader(bytes=png._pngsuite["basi" + name]).read()
+    straight = png.Reader(bytes=png._pngsuite["basn" + name]).read()
+    eq_(interlaced[:2], straight[:2])
+    eq_([list(row) for row in interlaced[2]],
+        [list(row) for row in straight[2]])
+
+def test_interlaced_suite():
+    for name in ("0g01", "0g02", "0g04", "0g08", "0g16",
+                 "2c08", "2c16", "6a08"):
+        yield check_interlaced, name
+
+def check_interlaced_size(width, height, bitdepth):
+    rand = random.Random(width * height)
+    maxval = 2 ** bitdepth - 1
+    rows = [[rand.randrange(maxval + 1) for x in xrange(width)]
+            for y in xrange(height)]
+    data = write_png(rows, greyscale=True, bitdepth=bitdepth, interlace=True)
+    (w, h, pixels, meta) = png.Reader(bytes=data).read()
+    eq_([list(row) for row in pixels], rows)
+
+def test_interlaced_sizes():
+    for (width, height) in ((1, 1), (1, 9), (9, 1), (3, 5), (13, 17)):
+        for bitdepth in (1, 4, 8, 16):
+            yield check_interlaced_size, width, height, bitdepth
+
+def test_save_if_changed():
+    import os
+    import shutil
+    import tempfile
+    dirname = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(dirname, "map.png")
+        digest_fname = os.path.join(dirname, "map.digest")
+        meta = {"bitdepth": 8, "alpha": True}
+        rows = make_rows(5, 4)
+        assert Image(5, 4, iter(rows), meta).save_if_changed(fname,
+                                                             digest_fname)
+        assert not Image(5, 4, iter(rows), meta).save_if_changed(fname,
+                                                                 digest_fname)
+        rows[2][3] ^= 1
+        assert Image(5, 4, iter(rows), meta).save_if_changed(fname,
+                                                             digest_fname)
+        with open(fname, "rb") as fp:
+            eq_(read_rows(fp.read()), (5, 4, rows))
+    finally:
+        shutil.rmtree(dirname)
+
+def test_webp_16bit():
+    from array import array
+    from nose.plugins.skip import SkipTest
+    from spritecss.encoders import get_encoder, EncoderUnavailable
+    try:
+        encoder = get_encoder("webp")
+    except EncoderUnavailable, e:
+        raise SkipTest(str(e))
+    from PIL import Image as PILImage
+    rows = [array("H", [0, 257, 65535, 65535, 32896, 128, 65280, 65535])]
+    fo = StringIO()
+    encoder.encode(Image(2, 1, rows, {"bitdepth": 16, "alpha": True}), fo)
+    fo.seek(0)
+    pil_im = PILImage.open(fo).convert("RGBA")
+    eq_(list(pil_im.getdata()), [(0, 1, 255, 255), (128, 0, 254, 255)])
+
+def read_generic(data):
+    """Decode *data* without the fast paths: through iterstraight and
+    iterboxed, or the whole-image deinterlace.
+    """
+    import itertools
+    from array import array
+    r = png.Reader(bytes=data)
+    r.preamble()
+    raw = r.idatdecomp()
+    if r.interlace:
+        flat = r.deinterlace(array("B", "".join(raw)))
+        vpr = r.width * r.planes
+        return [flat[i:i + vpr] for i in xrange(0, len(flat), vpr)]
+    raw = itertools.imap(array, itertools.repeat("B"), raw)
+    return list(r.iterboxed(r.iterstraight(raw)))
+
+def check_fast_decode(data):
+    (w, h, pixels, meta) = png.Reader(bytes=data).read()
+    eq_([list(row) for row in pixels],
+        [list(row) for row in read_generic(data)])
+
+def filtered_png(width, height, seed, colour_type=6, bitdepth=8):
+    """Make a PNG of random scanlines, each with a random filter type."""
+    from spritecss.png import write_chunk, _signature
+    import struct
+    rand = random.Random(seed)
+    planes = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}[colour_type]
+    row_bytes = (width * planes * bitdepth + 7) // 8
+    raw = "".join(chr(rand.randrange(5)) +
+                  "".join(chr(rand.randrange(256)) for i in xrange(row_bytes))
+                  for y in xrange(height))
+    fo = StringIO()
+    fo.write(_signature)
+    write_chunk(fo, "IHDR", struct.pack("!2I5B", width, height, bitdepth,
+                                        colour_type, 0, 0, 0))
+    if colour_type == 3:
+        write_chunk(fo, "PLTE", "".join(chr(i % 256) * 3
+                                        for i in xrange(2 ** bitdepth)))
+    write_chunk(fo, "IDAT", zlib.compress(raw))
+    write_chunk(fo, "IEND")
+    return fo.getvalue()
+
+def test_fast_decode():
+    # palette, tRNS, 16-bit, low bit depth, interlaced and not
+    for name in sorted(png._pngsuite):
+        yield check_fast_decode, png._pngsuite[name]
+    for (colour_type, bitdepth) in ((0, 8), (2, 8), (3, 8), (4, 8), (6, 8),
+                                    (6, 16), (3, 4), (0, 2)):
+        for seed in xrange(3):
+            data = filtered_png(13, 7, seed, colour_type, bitdepth)
+            yield check_fast_decode, data
+    rows = make_rows(9, 11)
+    for interlace in (False, True):
+        fo = StringIO()
+        png.Writer(9, 11, alpha=True, interlace=interlace).write(fo, rows)
+        yield check_fast_decode, fo.getvalue()
+        yield check_fast_decode, write_png([[0, 1, 7, 3]] * 5, bitdepth=4,
+                                           transparent=7, greyscale=True,
+                                           interlace=interlace)
+
+def ref_undo_filter(filter_type, fu, scanline, previous):
+    """Undo a filter byte by byte, following the PNG specification."""
+    result = list(scanline)
+    for i in xrange(len(result)):
+        a = result[i - fu] if i >= fu else 0
+        b = previous[i]
+        c = previous[i - fu] if i >= fu else 0
+        if filter_type == 1:
+            pred = a
+        elif filter_type == 2:
+            pred = b
+        elif filter_type == 3:
+            pred = (a + b) >> 1
+        else:
+            p = a + b - c
+            (pa, pb, pc) = (abs(p - a), abs(p - b), abs(p - c))
+            if pa <= pb and pa <= pc:
+                pred = a
+            elif pb <= pc:
+                pred = b
+            else:
+                pred = c
+        result[i] = (scanline[i] + pred) & 0xff
+    return result
+
+def check_filter(filter_type, fu, seed):
+    from array import array
+    undo = (None,
+            png.pngfilters.undo_filter_sub,
+            png.pngfilters.undo_filter_up,
+            png.pngfilters.undo_filter_average,
+            png.pngfilters.undo_filter_paeth)[filter_type]
+    rand = random.Random(seed)
+    for n in (1, fu, 2 * fu + 1, 97):
+        scanline = array("B", [rand.randrange(256) for i in xrange(n)])
+        previous = array("B", [rand.randrange(256) for i in xrange(n)])
+        expected = ref_undo_filter(filter_type, fu, scanline, previous)
+        # the reader undoes filters in place
+        undo(fu, scanline, previous, scanline)
+        eq_(list(scanline), expected)
+
+def test_filters():
+    for filter_type in (1, 2, 3, 4):
+        for fu in (1, 2, 3, 4, 6, 8):
+            for seed in xrange(3):
+                yield check_filter, filter_type, fu, seed
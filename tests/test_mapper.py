@@ -43,6 +43,28 @@ def test_confed_no_recurse():
             "test.png": None}
     return (conf, rels)
 
+@test_mapper
+def test_confed_sibling_dirs():
+    conf = CSSConfig(base={"recursive": False,
+                           "sprite_dirs": "foo foo/quux foobar"}, root="test")
+    rels = {"test/foo/bar.png": "test/foo.png",
+            "test/foo/quux/abc.png": "test/foo/quux.png",
+            "test/foo/quux/deeper/abc.png": "test/foo/quux.png",
+            "test/foobar/abc.png": "test/foobar.png",
+            "test/foob/abc.png": None}
+    return (conf, rels)
+
+def test_map_reduced():
+    conf = CSSConfig(base={"sprite_dirs": "foo"}, root="test")
+    fns = ["test/foo/a.png", "test/foo/b/c.png", "test/foo/a.png",
+           "test/foo/d.png", "test/other/e.png"]
+    smaps = mapper_from_conf(conf).map_reduced(
+        SpriteRef(fn, source="test/file.css") for fn in fns)
+    eq_(sorted((k, map(str, v)) for (k, v) in smaps.iteritems()),
+        [(None, ["test/other/e.png"]),
+         ("test/foo.png", ["test/foo/a.png", "test/foo/d.png"]),
+         ("test/foo/b.png", ["test/foo/b/c.png"])])
+
 def test_confed_single_map():
     conf = CSSConfig(base={"output_image": "sm.png"}, root="test")
     sm_fn = "test/sm.png"
@@ -51,3 +73,76 @@ def test_confed_single_map():
             "test/foo/quux/abc.png",
             "test/foo.png")
     return (conf, dict((sfn, sm_fn) for sfn in sfns))
+
+def test_cluster_by_usage():
+    from spritecss.mapper import cluster_by_usage
+    srefs = [SpriteRef(fn, source=None) for fn in "abcde"]
+    sources = {"a": set(["x.css", "y.css"]),
+               "b": set(["x.css", "y.css"]),
+               "c": set(["x.css"]),
+               "d": set(["y.css"]),
+               "e": set(["y.css"])}
+    weights = {"a": 100, "b": 100, "c": 5000, "d": 10, "e": 10}
+    weight = lambda sref: weights[sref.fname]
+    groups = cluster_by_usage(srefs, sources, request_cost=1000,
+                              weight=weight)
+    groups = sorted(sorted(map(str, g)) for g in groups)
+    # c is too heavy to burden y.css with, while d and e are cheap
+    eq_(groups, [["a", "b", "d", "e"], ["c"]])
+
+def test_iter_usage_split():
+    import os
+    import shutil
+    import tempfile
+    from spritecss.css import scan_css
+    from spritecss.finder import find_sprite_refs
+    from spritecss.mapper import SpriteMapCollector
+    dirname = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(dirname, "img"))
+        for (name, size) in [("shared", 100), ("big", 5000), ("small", 10)]:
+            with open(os.path.join(dirname, "img", name + ".png"), "wb") as fp:
+                fp.write("x" * size)
+        stylesheets = [("a.css", ["shared", "big"]),
+                       ("b.css", ["shared", "small"])]
+        base = CSSConfig(base={"split_by_usage": "yes"})
+        smaps = SpriteMapCollector(conf=base)
+        for (css_fn, names) in stylesheets:
+            css_fn = os.path.join(dirname, css_fn)
+            evs = list(scan_css("".join(".%s { background: url(img/%s.png); }"
+                                        % (n, n) for n in names)))
+            conf = CSSConfig(evs, base=base, fname=css_fn)
+            srefs = find_sprite_refs(evs, conf=conf, source=css_fn)
+            smaps.collect(mapper_from_conf(conf).map_reduced(srefs))
+        assert base.split_by_usage
+        parts = list(smaps.iter_usage_split(request_cost=base.request_cost))
+        rel = lambda fn: os.path.relpath(fn, dirname)
+        # big.png isn't worth making b.css download, small.png is
+        eq_([(rel(p.fname), rel(p.origin), [rel(str(s)) for s in p])
+             for p in parts],
+            [("img-1.png", "img.png", ["img/shared.png", "img/small.png"]),
+             ("img-2.png", "img.png", ["img/big.png"])])
+    finally:
+        shutil.rmtree(dirname)
+
+def test_sprite_ref_interning():
+    import copy
+    import pickle
+    a = SpriteRef("test/foo/a.png", source="x.css")
+    assert SpriteRef("test/foo/a.png", source="x.css") is a
+    assert SpriteRef("test/foo/a.png", source="y.css") is not a
+    eq_(SpriteRef("test/foo/a.png", source="y.css"), a)
+    assert copy.deepcopy(a) is a
+    assert pickle.loads(pickle.dumps(a, 2)) is a
+
+def test_sprite_map_dedupe():
+    from spritecss import SpriteMap
+    srefs = [SpriteRef(fn, source=src) for src in ("x.css", "y.css")
+                                       for fn in ("a.png", "b.png")]
+    smap = SpriteMap("sm.png", srefs)
+    eq_(map(str, smap), ["a.png", "b.png"])
+    smap.extend([SpriteRef("c.png", source="x.css")] + srefs)
+    smap.append(SpriteRef("a.png", source="z.css"))
+    eq_(map(str, smap), ["a.png", "b.png", "c.png"])
+    assert SpriteRef("b.png", source="z.css") in smap
+    assert SpriteRef("d.png", source="x.css") not in smap
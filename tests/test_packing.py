@@ -0,0 +1,163 @@
+import shutil
+import tempfile
+from nose.tools import eq_, with_setup
+from spritecss.packing import Rect, PackedBoxes
+from spritecss.packing.cache import PackingCache
+from spritecss.packing.naive import naive_packing
+from spritecss.packing.sprites import SpriteNode
+
+class FakeImage(object):
+    bitdepth = 8
+
+    def __init__(self, width, height):
+        self.pixels = [bytearray(width * 4) for i in range(height)]
+
+    def close(self):
+        pass
+
+class FakeSprite(SpriteNode):
+    def __init__(self, width, height, fname=None, pad=(1, 1)):
+        im = FakeImage(width, height)
+        SpriteNode.__init__(self, im, width, height, fname=fname, pad=pad)
+
+def make_sprites(sizes):
+    return [FakeSprite(w, h) for (w, h) in sizes]
+
+_sizes = [(16, 16), (16, 16), (32, 8), (8, 32), (20, 10), (5, 5)]
+
+cache_dir = None
+
+def setup_cache():
+    global cache_dir
+    cache_dir = tempfile.mkdtemp()
+
+def teardown_cache():
+    shutil.rmtree(cache_dir)
+
+def assert_no_overlap(placements):
+    rects = [Rect((x, y, x + b.outer_width, y + b.outer_height))
+             for ((x, y), b) in placements]
+    for i, a in enumerate(rects):
+        for b in rects[i + 1:]:
+            assert (a.x2 <= b.x1 or b.x2 <= a.x1 or
+                    a.y2 <= b.y1 or b.y2 <= a.y1), (a, b)
+
+@with_setup(setup_cache, teardown_cache)
+def test_annealing_cache_reuse():
+    cache = PackingCache(cache_dir)
+    first = PackedBoxes(make_sprites(_sizes), anneal_steps=50, cache=cache)
+    # reversed input order must map onto the same layout
+    sprites = make_sprites(reversed(_sizes))
+    second = PackedBoxes(sprites, anneal_steps=50, cache=cache)
+    eq_(first.size, second.size)
+    eq_(sorted((p, b.outer_size) for (p, b) in first.placements),
+        sorted((p, b.outer_size) for (p, b) in second.placements))
+    eq_(set(map(id, sprites)), set(id(b) for (p, b) in second.placements))
+    assert_no_overlap(second.placements)
+
+@with_setup(setup_cache, teardown_cache)
+def test_naive_cache_reuse():
+    cache = PackingCache(cache_dir)
+    uncached = naive_packing(make_sprites(_sizes))[1]
+    naive_packing(make_sprites(_sizes), cache=cache)
+    sprites = make_sprites(reversed(_sizes))
+    cached = naive_packing(sprites, cache=cache)[1]
+    eq_(sorted((p, b.outer_size) for (p, b) in uncached),
+        sorted((p, b.outer_size) for (p, b) in cached))
+    eq_(set(map(id, sprites)), set(id(b) for (p, b) in cached))
+
+def test_warm_packing_keeps_positions():
+    from spritecss.packing.warm import warm_packing
+    sprites = make_sprites(_sizes)
+    for i, sprite in enumerate(sprites):
+        sprite.fname = "s%d.png" % (i,)
+    placements = naive_packing(sprites)[1]
+    layout = dict((b.fname, b.calc_box(p)) for (p, b) in placements)
+    added = FakeSprite(7, 7, fname="new.png")
+    packing = warm_packing(sprites + [added], layout, max_waste=1.0)
+    got = dict((b.fname, p) for (p, b) in packing)
+    for (pos, sprite) in placements:
+        eq_(got[sprite.fname], pos)
+    assert "new.png" in got
+    assert_no_overlap(list(packing))
+
+def test_warm_packing_keeps_size():
+    from spritecss.packing.warm import read_layout, write_layout, warm_packing
+    dirname = tempfile.mkdtemp()
+    sprites = make_sprites(_sizes)
+    for i, sprite in enumerate(sprites):
+        sprite.fname = "%s/s%d.png" % (dirname, i)
+    packed = PackedBoxes(sprites, anneal_steps=50)
+    try:
+        layout_fn = dirname + "/map.png.layout"
+        write_layout(layout_fn, packed.placements, size=packed.size)
+        layout = read_layout(layout_fn)
+    finally:
+        shutil.rmtree(dirname)
+    eq_(layout.size, packed.size)
+    packing = warm_packing(sprites, layout, max_waste=1.0)
+    # the annealer's size includes trailing padding, which is kept
+    eq_(packing.size, packed.size)
+    eq_(packing.outer_area, packed.outer_area)
+    eq_(packing.steps, 0)
+    assert packing.lower_bound <= packing.outer_area
+
+def test_lower_bound():
+    from spritecss.packing import area_lower_bound
+    eq_(area_lower_bound(make_sprites([(5, 5), (5, 5)])), 2 * 6 * 6)
+    # boxes wider than half the width can't sit side by side, and 5x3 is the
+    # narrowest width they fit next to each other in
+    eq_(area_lower_bound(make_sprites([(2, 2), (1, 1)])), 15)
+    eq_(area_lower_bound(make_sprites([(30, 1), (20, 1)])), 52 * 2)
+    eq_(area_lower_bound([FakeSprite(2, 1, pad=(0, 0)),
+                          FakeSprite(2, 1, pad=(0, 0)),
+                          FakeSprite(1, 1, pad=(0, 0))]), 5)
+    eq_(area_lower_bound(make_sprites([(21, 36), (12, 35)])), 35 * 37)
+
+def check_lower_bound_holds(sprites):
+    from spritecss.packing import area_lower_bound
+    from spritecss.packing.naive import naive_pack
+    bound = area_lower_bound(sprites)
+    packing = naive_pack(sprites)
+    packed = PackedBoxes(sprites, anneal_steps=20)
+    assert bound <= packing.outer_area, (bound, packing.outer_area)
+    assert bound <= packed.outer_area, (bound, packed.outer_area)
+    assert packing.unused_amount >= 0
+    assert packed.unused_amount >= 0
+
+def test_lower_bound_holds():
+    import random
+    yield check_lower_bound_holds, make_sprites(_sizes)
+    rand = random.Random(0)
+    for i in xrange(100):
+        pad = rand.choice([(0, 0), (1, 1), (2, 0)])
+        sizes = [(rand.randint(1, 40), rand.randint(1, 40))
+                 for j in xrange(rand.randint(2, 6))]
+        yield check_lower_bound_holds, [FakeSprite(w, h, pad=pad)
+                                        for (w, h) in sizes]
+
+def test_split_packing_max_size():
+    from spritecss.packing.split import split_packing
+    from spritecss.packing.naive import naive_pack
+    sprites = make_sprites(_sizes * 4)
+    max_size = (40, 40)
+    parts = split_packing(sprites, lambda s, m: naive_pack(s, max_size=m),
+                          max_size=max_size)
+    assert len(parts) > 1
+    eq_(sum(len(list(p)) for p in parts), len(sprites))
+    for packing in parts:
+        assert packing.width <= max_size[0], packing.size
+        assert packing.height <= max_size[1], packing.size
+        assert_no_overlap(list(packing))
+
+def test_annealing_max_size():
+    from spritecss.packing import NoRoom
+    packed = PackedBoxes(make_sprites(_sizes), anneal_steps=50,
+                         max_size=(60, 60))
+    assert packed.size[0] <= 60 and packed.size[1] <= 60
+    try:
+        PackedBoxes(make_sprites(_sizes), anneal_steps=50, max_size=(20, 20))
+    except NoRoom:
+        pass
+    else:
+        raise AssertionError("expected NoRoom")
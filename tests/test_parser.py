@@ -38,3 +38,32 @@ def test_reprint_test_files():
     for fn in glob(path.join(css_dirn, "*.css")):
         with open(fn, "rb") as fp:
             reprint(fp.read())
+
+def test_events_detached():
+    evs = list(parser.CSSParser(data="a {\n  b: c;\n}\n"))
+    eq = [(ev.lexeme, ev.text, ev.offset) for ev in evs]
+    assert eq == [("selector", "a ", 2),
+                  ("whitespace", "\n  ", 6),
+                  ("declaration", "b: c", 10),
+                  ("whitespace", "\n", 12),
+                  ("block_end", "", 12),
+                  ("whitespace", "\n", 14)], eq
+    assert evs[2].start == 6
+    for ev in evs:
+        assert not hasattr(ev, "__dict__")
+        assert not hasattr(ev, "state")
+
+def test_print_css_buffered():
+    from StringIO import StringIO
+    css = "a { b: c; }\n" * 100
+    class Out(StringIO):
+        writes = 0
+        def write(self, data):
+            self.writes += 1
+            StringIO.write(self, data)
+    out = Out()
+    parser.print_css(parser.CSSParser(data=css), out=out, buffer_size=500)
+    assert out.getvalue() == css
+    assert out.writes == 3, out.writes
+    blocks = list(parser.iter_buffered(["ab", "c" * 10, "d"], 4))
+    assert blocks == ["ab", "c" * 10, "d"], blocks
@@ -0,0 +1,122 @@
+from contextlib import contextmanager
+from nose.tools import eq_
+from spritecss import SpriteMap, SpriteRef
+from spritecss.config import CSSConfig
+from spritecss.main import CSSFile
+from spritecss.replacer import SpriteReplacer
+
+class FakeCSSFile(CSSFile):
+    def __init__(self, data):
+        conf = CSSConfig(base={"output_image": "sprites.png"}, root="/css")
+        super(FakeCSSFile, self).__init__("/css/main.css", conf=conf)
+        self.data = data
+
+    @contextmanager
+    def open_data(self):
+        yield self.data
+
+class Placed(object):
+    def __init__(self, fname):
+        self.fname = SpriteRef(fname, source="/css/main.css")
+
+def make_replacer(retina=False):
+    smap = SpriteMap("/css/sprites.png")
+    if retina:
+        smap.retina = ("/css/sprites@2x.png", (40, 20))
+    plcs = [((0, 0), Placed("/css/a.png")), ((20, 4), Placed("/css/b.png"))]
+    return SpriteReplacer([(smap, plcs)])
+
+def test_spliced():
+    css = ("/* a.png */ .a{color:red;background:url(a.png)}\n"
+           ".b {\n  background:  url(b.png)  ;\n  margin:0\n}\n"
+           ".c { background:url(c.png); }\n")
+    out = "".join(make_replacer().iter_spliced(FakeCSSFile(css)))
+    assert out == ("/* a.png */ .a{color:red;background: url('sprites.png') "
+                   "no-repeat 0 0}\n"
+                   ".b {\n  background: url('sprites.png') no-repeat "
+                   "-20px -4px;\n  margin:0\n}\n"
+                   ".c { background:url(c.png); }\n"), out
+
+def test_spliced_retina():
+    css = ".a { background: url(a.png); }\n"
+    out = "".join(make_replacer(retina=True).iter_spliced(FakeCSSFile(css)))
+    assert out.startswith(".a { background: url('sprites.png') no-repeat "
+                          "0 0; }\n@media "), out
+    assert "background-image: url('sprites@2x.png');" in out
+
+def decode_mappings(mappings):
+    from spritecss.css.sourcemap import _b64chars
+    lines = []
+    state = [0, 0, 0, 0]
+    for line in mappings.split(";"):
+        segs = []
+        state[0] = 0
+        for seg in filter(None, line.split(",")):
+            values = []
+            value = shift = 0
+            for char in seg:
+                digit = _b64chars.index(char)
+                value += (digit & 31) << shift
+                shift += 5
+                if not digit & 32:
+                    values.append(-(value >> 1) if value & 1 else value >> 1)
+                    value = shift = 0
+            state = [s + v for (s, v) in zip(state, values)]
+            segs.append(tuple(state))
+        lines.append(segs)
+    return lines
+
+def test_source_map():
+    from spritecss.css.lines import LineIndex
+    from spritecss.css.sourcemap import SourceMap, encode_vlq
+    eq_([encode_vlq(v) for v in (0, 1, -1, 16, 123)],
+        ["A", "C", "D", "gB", "2H"])
+    css = ".a { background: url(a.png); }\n.b { }\n"
+    source_map = SourceMap(LineIndex(css))
+    out = "".join(make_replacer().iter_spliced(FakeCSSFile(css),
+                                               source_map=source_map))
+    code_end = out.index(";")
+    eq_(decode_mappings(source_map.mappings),
+        [[(0, 0, 0, 0), (5, 0, 0, 5), (code_end, 0, 0, 27)],
+         [(0, 0, 1, 0)],
+         []])
+    eq_(LineIndex(css).position(css.index(".b")), (2, 1))
+
+def test_stream_css():
+    import os
+    from StringIO import StringIO
+    from spritecss.main import StreamCSSFile, _write_css
+    css = "/* spritemapper.padding = 3 */\n.a { background: url(a.png); }\n"
+    (rfd, wfd) = os.pipe()
+    os.write(wfd, css)
+    os.close(wfd)
+    out = StringIO()
+    with os.fdopen(rfd, "rb") as fp:
+        stream = StreamCSSFile.open_stream(fp, out)
+        # pipes can't be rewound, so it must have been spooled
+        assert stream.fp is not fp
+    eq_(stream.conf.padding, "3")
+    eq_(_write_css(stream, SpriteReplacer([])), None)
+    eq_(out.getvalue(), css)
+
+def test_stream_css_large():
+    import os
+    from threading import Thread
+    from StringIO import StringIO
+    from spritecss.main import StreamCSSFile, _write_css, mmap_threshold
+    css = (".a { background: url(a.png); }\n/* %s */\n.b { color: red; }\n"
+           % ("x" * mmap_threshold))
+    (rfd, wfd) = os.pipe()
+    def feed():
+        with os.fdopen(wfd, "wb") as fp:
+            fp.write(css)
+    # the pipe's buffer is smaller than the stylesheet
+    feeder = Thread(target=feed)
+    feeder.start()
+    out = StringIO()
+    with os.fdopen(rfd, "rb") as fp:
+        stream = StreamCSSFile.open_stream(fp, out)
+    feeder.join()
+    eq_(_write_css(stream, SpriteReplacer([])), None)
+    eq_(len(out.getvalue()), len(css))
+    eq_(out.getvalue(), css)
@@ -0,0 +1,31 @@
+from os import path
+from glob import glob
+from spritecss.css import CSSParser
+from spritecss.css.parser import iter_print_css
+from spritecss.css.scan import scan_css, iter_segments
+
+css_dirn = path.join(path.dirname(__file__), "test_css_files")
+
+def event_tuples(evs):
+    return [(ev.lexeme, ev.text, ev.offset) for ev in evs]
+
+def test_segments():
+    css = ("a { b: '}'; } /* } { */ @media x { c { d: e; } }\n"
+           'f { g: "\\"}" }')
+    segs = [css[start:end] for (start, end) in iter_segments(css)]
+    assert segs == ["a { b: '}'; }",
+                    " /* } { */ @media x { c { d: e; } }",
+                    '\nf { g: "\\"}" }'], segs
+
+def test_scan_test_files():
+    for fn in glob(path.join(css_dirn, "*.css")):
+        with open(fn, "rb") as fp:
+            css = fp.read()
+        full = event_tuples(CSSParser(data=css))
+        # parsing every segment on its own gives the same events
+        assert event_tuples(scan_css(css, needles=("",))) == full
+        # skipping segments loses no code
+        assert "".join(iter_print_css(scan_css(css))) == css
+        assert [ev for ev in event_tuples(scan_css(css))
+                if "url(" in ev[1] and ev[0] != "verbatim"] == \
+               [ev for ev in full if "url(" in ev[1]]